@@ -1,33 +1,64 @@
 """Инициализация и запуск Telegram бота."""
 
+import asyncio
+import functools
 import logging
 from telegram.ext import Application, ChatJoinRequestHandler, MessageHandler, filters
 
-from .handlers import join_request_handler, message_handler, edited_message_handler, error_handler
+from ..config import Config
+from .handlers import join_request_handler, message_handler, error_handler
+from .message_buffer import MessageBuffer
 
 logger = logging.getLogger(__name__)
 
+# Long polling: сервер Telegram держит getUpdates до POLLING_TIMEOUT секунд,
+# пока нет новых апдейтов, — меньше пустых запросов.
+POLLING_TIMEOUT = 30
 
-def create_bot(token: str) -> Application:
+# Сколько ждать записи остатка буфера при остановке. Отдельно от таймаута
+# stop_bot: запасной путь по одному сообщению на большой пачке идёт дольше.
+BUFFER_FLUSH_TIMEOUT = 60
+
+# Фильтр собирается один раз при импорте модуля: новые и отредактированные
+# сообщения из групп (без команд) идут в один обработчик.
+_MESSAGE_FILTER = (
+    (filters.UpdateType.MESSAGE | filters.UpdateType.EDITED_MESSAGE)
+    & filters.ChatType.GROUPS
+    & ~filters.COMMAND
+)
+
+
+def create_bot(config: Config) -> Application:
     """Создаёт и настраивает приложение бота."""
-    application = Application.builder().token(token).build()
+    application = (
+        Application.builder()
+        .token(config.telegram_token)
+        .concurrent_updates(True)
+        .pool_timeout(30)
+        .get_updates_pool_timeout(40)
+        .build()
+    )
+
+    # Буфер пачечной записи сообщений; фоновая задача запускается в start_bot
+    application.bot_data["message_buffer"] = MessageBuffer(
+        max_batch=config.message_batch_size,
+        flush_interval=config.message_flush_interval_ms / 1000,
+    )
 
     # Chat join requests (only stored for configured chat_id inside handler).
-    application.add_handler(ChatJoinRequestHandler(join_request_handler))
-    
-    # Обработчик всех сообщений (не только текстовых)
     application.add_handler(
-        MessageHandler(
-            filters.ALL & ~filters.COMMAND & filters.ChatType.GROUPS,
-            message_handler
+        ChatJoinRequestHandler(
+            functools.partial(join_request_handler, chat_id=config.vibecoder_chat_id)
         )
     )
     
-    # Обработчик отредактированных сообщений
+    # Обработчик всех сообщений (не только текстовых), включая правки.
+    # block=False: сохранение в БД не задерживает обработку следующих апдейтов.
     application.add_handler(
         MessageHandler(
-            filters.UpdateType.EDITED_MESSAGE & filters.ChatType.GROUPS,
-            edited_message_handler
+            _MESSAGE_FILTER,
+            message_handler,
+            block=False,
         )
     )
     
@@ -44,8 +75,14 @@ async def start_bot(application: Application):
     logger.info("Make sure Privacy Mode is DISABLED in @BotFather for this bot!")
     
     await application.initialize()
+
+    # Буфер запускается до приёма апдейтов
+    application.bot_data["message_buffer"].start()
+
     await application.start()
     await application.updater.start_polling(
+        timeout=POLLING_TIMEOUT,
+        bootstrap_retries=-1,
         drop_pending_updates=True,
         allowed_updates=["message", "edited_message", "chat_join_request"]
     )
@@ -60,3 +97,24 @@ async def stop_bot(application: Application):
     await application.stop()
     await application.shutdown()
     logger.info("Bot stopped")
+
+
+async def flush_message_buffer(application: Application):
+    """Записывает остаток буфера сообщений и останавливает его фоновую задачу.
+
+    Вызывается после stop_bot: обработчиков больше нет, новых сообщений
+    в буфер не придёт. Не уложившиеся в BUFFER_FLUSH_TIMEOUT сообщения
+    теряются — их число пишется в лог.
+    """
+    buffer = application.bot_data.get("message_buffer")
+    if buffer is None:
+        return
+
+    try:
+        await asyncio.wait_for(buffer.stop(), timeout=BUFFER_FLUSH_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.error(
+            "Message buffer flush timed out after %ss, %s messages dropped",
+            BUFFER_FLUSH_TIMEOUT,
+            buffer.pending,
+        )
@@ -2,8 +2,13 @@
 
 import asyncio
 import logging
+import queue
+import re
+import time
 from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
+from typing import Optional
 
 from telegram import Update
 from telegram.ext import ContextTypes
@@ -11,20 +16,18 @@ from telegram.error import BadRequest, TelegramError
 
 from ..config import get_config
 from ..models import (
-    save_message,
     save_join_request_fields,
     get_pending_fresh_join_requests,
-    mark_join_requests_status,
+    mark_join_requests_statuses,
+    compact_stats_counters,
 )
 
 logger = logging.getLogger(__name__)
 _clean_join_requests_lock = asyncio.Lock()
 
-
-def _is_expired_join_request_error(text: str) -> bool:
-    t = (text or "").lower()
-    return any(
-        needle in t
+_EXPIRED_JOIN_REQUEST_RE = re.compile(
+    "|".join(
+        re.escape(needle)
         for needle in (
             "chat_join_request_not_found",
             "join request not found",
@@ -33,32 +36,98 @@ def _is_expired_join_request_error(text: str) -> bool:
             "user is already a participant",
             "user_not_found",
         )
-    )
+    ),
+    re.IGNORECASE,
+)
+_ONE_LINE_TABLE = str.maketrans({"\n": " ", "\r": " "})
 
+# Сколько decline_chat_join_request выполняется параллельно (лимиты Telegram API).
+_DECLINE_CONCURRENCY = 10
 
-def _sanitize_one_line(text: str) -> str:
-    return (text or "").replace("\n", " ").replace("\r", " ").strip()
+# Подсказка для clean_join_requests_job: сколько заявок пришло с последней проверки.
+# Пока она нулевая, job не ходит в БД; раз в _PENDING_RECONCILE_SEC проверка
+# выполняется всё равно (заявки, оставшиеся с прошлого запуска, и т.п.).
+_pending_hint = 0
+# -inf: первая проверка после старта идёт сразу, как бы мало ни было
+# time.monotonic() на только что загруженном хосте
+_last_pending_check = float("-inf")
+_PENDING_RECONCILE_SEC = 600
+
+# Как часто дельты счётчиков статистики переносятся в stats_counters.
+STATS_COMPACT_INTERVAL_SEC = 60
+
+
+# Аудит-лог отклонённых заявок: запись в файл идёт в потоке QueueListener,
+# event loop только кладёт запись в очередь.
+_decline_audit_logger = logging.getLogger("decline_audit")
+_decline_audit_listener: Optional[QueueListener] = None
+
+
+def init_decline_audit_log(log_path: str) -> None:
+    """Подключает файл аудит-лога отклонённых заявок (вызывается один раз при старте)."""
+    global _decline_audit_listener
+    if _decline_audit_listener is not None:
+        return
+
+    Path(log_path).parent.mkdir(parents=True, exist_ok=True)
+    file_handler = logging.FileHandler(log_path, encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter("%(message)s"))
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    _decline_audit_listener = QueueListener(records, file_handler)
+    _decline_audit_listener.start()
+
+    _decline_audit_logger.addHandler(QueueHandler(records))
+    _decline_audit_logger.setLevel(logging.INFO)
+    _decline_audit_logger.propagate = False
+
+
+def stop_decline_audit_log() -> None:
+    """Дописывает очередь аудит-лога в файл и останавливает поток записи."""
+    global _decline_audit_listener
+    if _decline_audit_listener is None:
+        return
 
+    _decline_audit_listener.stop()
+    _decline_audit_listener = None
 
-def _append_log_line(fp, line: str) -> None:
-    fp.write(line + "\n")
-    fp.flush()
+
+def _is_expired_join_request_error(text: str) -> bool:
+    return bool(_EXPIRED_JOIN_REQUEST_RE.search(text or ""))
 
 
-async def join_request_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Collect chat join requests into DB (only for VIBECODER_CHAT_ID)."""
+def _sanitize_one_line(text: str) -> str:
+    if not text:
+        return ""
+    # Переводы строк в именах редкость — translate только когда они есть.
+    if "\n" in text or "\r" in text:
+        text = text.translate(_ONE_LINE_TABLE)
+    return text.strip()
+
+
+async def join_request_handler(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    *,
+    chat_id: Optional[int],
+):
+    """Collect chat join requests into DB (only for VIBECODER_CHAT_ID).
+
+    chat_id is bound at bot-build time (see create_bot).
+    """
     req = update.chat_join_request
     if not req:
         return
 
-    cfg = get_config()
-    if not cfg.vibecoder_chat_id:
+    if not chat_id:
         logger.warning("VIBECODER_CHAT_ID is not set; ignoring join request")
         return
 
-    if req.chat.id != cfg.vibecoder_chat_id:
+    if req.chat.id != chat_id:
         return
 
+    global _pending_hint
+
     user = req.from_user
     try:
         await save_join_request_fields(
@@ -71,64 +140,66 @@ async def join_request_handler(update: Update, context: ContextTypes.DEFAULT_TYP
             user=user,
             chat=req.chat,
         )
-        logger.info(f"Saved join request: chat_id={req.chat.id} user_id={user.id}")
+        _pending_hint += 1
+        logger.info("Saved join request: chat_id=%s user_id=%s", req.chat.id, user.id)
     except Exception as e:
-        logger.error(f"Failed to save join request: chat_id={req.chat.id} user_id={user.id} err={e}")
+        logger.error("Failed to save join request: chat_id=%s user_id=%s err=%s", req.chat.id, user.id, e)
 
 
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик новых сообщений."""
+    """Обработчик новых и отредактированных сообщений."""
     msg = update.effective_message
     
     if not msg:
         return
     
-    # Только групповые чаты
-    if msg.chat.type not in ['group', 'supergroup']:
-        logger.debug(f"Ignoring message from non-group chat: {msg.chat.type}")
-        return
-    
+    # Тип чата уже проверен фильтром в create_bot
     # Должен быть автор
     if not msg.from_user:
         logger.debug("Ignoring message without from_user")
         return
     
-    try:
-        await save_message(msg, is_edit=False)
-        logger.info(
-            f"Saved message {msg.message_id} from {msg.from_user.id} "
-            f"in chat {msg.chat_id} ({msg.chat.title or 'No title'})"
-        )
-    except Exception as e:
-        logger.error(f"Failed to save message {msg.message_id}: {e}")
-
-
-async def edited_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик отредактированных сообщений."""
-    msg = update.edited_message
-    
-    if not msg:
-        return
-    
-    # Только групповые чаты
-    if msg.chat.type not in ['group', 'supergroup']:
-        return
-    
-    if not msg.from_user:
-        return
-    
-    try:
-        await save_message(msg, is_edit=True)
-        logger.info(
-            f"Updated edited message {msg.message_id} in chat {msg.chat_id}"
-        )
-    except Exception as e:
-        logger.error(f"Failed to update message {msg.message_id}: {e}")
+    is_edit = update.edited_message is not None
+    # Запись в БД идёт пачками через MessageBuffer (см. start_bot)
+    context.bot_data["message_buffer"].put(msg, is_edit)
+    logger.debug(
+        "Queued %s message %s from %s in chat %s",
+        "edited" if is_edit else "new", msg.message_id, msg.from_user.id, msg.chat_id,
+    )
 
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок бота."""
-    logger.error(f"Update {update} caused error: {context.error}")
+    logger.error("Update %s caused error: %s", update, context.error)
+
+
+async def _decline_join_request(
+    bot,
+    chat_id: int,
+    req: dict,
+    sem: asyncio.Semaphore,
+) -> tuple[str, str]:
+    """Decline one join request in Telegram.
+
+    Returns: (outcome, error_message); outcome is declined/expired/error.
+    """
+    user_id = req["user_id"]
+    outcome = "error"
+    err_msg = ""
+    async with sem:
+        try:
+            await bot.decline_chat_join_request(chat_id=chat_id, user_id=user_id)
+            outcome = "declined"
+        except BadRequest as e:
+            err_msg = f"{type(e).__name__}: {e}"
+            if _is_expired_join_request_error(str(e)):
+                outcome = "expired"
+        except TelegramError as e:
+            err_msg = f"{type(e).__name__}: {e}"
+        except Exception as e:
+            err_msg = f"{type(e).__name__}: {e}"
+
+    return outcome, err_msg
 
 
 async def process_pending_fresh_join_requests(
@@ -136,74 +207,102 @@ async def process_pending_fresh_join_requests(
     chat_id: int,
     threshold: int,
     limit: int,
-    log_path: str,
-) -> tuple[int, int]:
+) -> tuple[int, int, int]:
     """Decline pending 'fresh' join requests and log results.
 
-    Returns: (declined_count, processed_count)
+    Audit lines go to the file set up by init_decline_audit_log().
+
+    Telegram calls run concurrently (at most _DECLINE_CONCURRENCY at a time),
+    statuses are then written to DB in one pipelined round-trip.
+
+    Returns: (declined_count, processed_count, error_count); requests that
+    failed with "error" stay pending and should be retried.
     """
     pending = await get_pending_fresh_join_requests(chat_id, threshold, limit)
     processed = len(pending)
-    declined = 0
 
     if processed == 0:
-        return 0, 0
-
-    log_file = Path(log_path)
-    log_file.parent.mkdir(parents=True, exist_ok=True)
-
-    with log_file.open("a", encoding="utf-8") as fp:
-        for req in pending:
-            req_id = int(req["id"])
-            user_id = int(req["user_id"])
-            username = req.get("username") or ""
-            first_name = req.get("first_name") or ""
-
-            outcome = "error"
-            err_msg = ""
-            try:
-                await bot.decline_chat_join_request(chat_id=chat_id, user_id=user_id)
-                await mark_join_requests_status([req_id], "declined")
-                declined += 1
-                outcome = "declined"
-            except BadRequest as e:
-                err_msg = f"{type(e).__name__}: {e}"
-                if _is_expired_join_request_error(str(e)):
-                    await mark_join_requests_status([req_id], "expired")
-                    outcome = "expired"
-            except TelegramError as e:
-                err_msg = f"{type(e).__name__}: {e}"
-            except Exception as e:
-                err_msg = f"{type(e).__name__}: {e}"
-
-            ts = datetime.now(timezone.utc).isoformat()
-            line = (
-                f"{ts}\t{outcome}\trequest_id={req_id}\tchat_id={chat_id}\tuser_id={user_id}\t"
-                f"username={_sanitize_one_line(username)}\tfirst_name={_sanitize_one_line(first_name)}\t"
-                f"message={_sanitize_one_line(err_msg)}"
-            )
-            _append_log_line(fp, line)
-            logger.info(line)
-
-    return declined, processed
+        return 0, 0, 0
+
+    sem = asyncio.Semaphore(_DECLINE_CONCURRENCY)
+    results = await asyncio.gather(
+        *(_decline_join_request(bot, chat_id, req, sem) for req in pending)
+    )
+
+    declined_ids = [
+        req["id"] for req, (outcome, _) in zip(pending, results) if outcome == "declined"
+    ]
+    expired_ids = [
+        req["id"] for req, (outcome, _) in zip(pending, results) if outcome == "expired"
+    ]
+    await mark_join_requests_statuses({"declined": declined_ids, "expired": expired_ids})
+    errors = processed - len(declined_ids) - len(expired_ids)
+
+    # Одна метка времени на пачку: все запросы пачки обработаны одним gather.
+    ts = datetime.now(timezone.utc).isoformat()
+    chat_field = f"chat_id={chat_id}"
+    for req, (outcome, err_msg) in zip(pending, results):
+        req_id = req["id"]
+        user_id = req["user_id"]
+        username = req.get("username") or ""
+        first_name = req.get("first_name") or ""
+
+        line = "\t".join((
+            ts,
+            outcome,
+            f"request_id={req_id}",
+            chat_field,
+            f"user_id={user_id}",
+            "username=" + _sanitize_one_line(username),
+            "first_name=" + _sanitize_one_line(first_name),
+            "message=" + _sanitize_one_line(err_msg),
+        ))
+        _decline_audit_logger.info(line)
+        logger.info("%s", line)
+
+    return len(declined_ids), processed, errors
 
 
 async def clean_join_requests_job(context: ContextTypes.DEFAULT_TYPE):
     """JobQueue: periodically decline fresh pending join requests."""
+    global _pending_hint, _last_pending_check
+
+    # Проверки "нечего делать" идут без блокировки
+    cfg = get_config()
+    if not cfg.vibecoder_chat_id:
+        return
+
+    now = time.monotonic()
+    if _pending_hint <= 0 and now - _last_pending_check < _PENDING_RECONCILE_SEC:
+        return
+
     if _clean_join_requests_lock.locked():
         return
 
     async with _clean_join_requests_lock:
-        cfg = get_config()
-        if not cfg.vibecoder_chat_id:
-            return
-
-        declined, processed = await process_pending_fresh_join_requests(
+        seen = _pending_hint
+        _last_pending_check = now
+        declined, processed, errors = await process_pending_fresh_join_requests(
             context.bot,
             cfg.vibecoder_chat_id,
             cfg.fresh_account_id_threshold,
             cfg.join_request_clean_batch_limit,
-            cfg.declined_requests_log_path,
         )
+        # Заявки с ошибкой (сеть, Telegram) остались pending — подсказка
+        # остаётся положительной, и они повторяются на следующем тике.
+        # Неполная пачка без ошибок — свежих заявок в БД не осталось; заявки,
+        # пришедшие во время обработки, остаются в подсказке.
+        if errors:
+            _pending_hint = max(_pending_hint, errors)
+        elif processed < cfg.join_request_clean_batch_limit:
+            _pending_hint = max(0, _pending_hint - seen)
         if processed:
-            logger.info(f"Declined {declined}/{processed} pending requests")
+            logger.info("Declined %s/%s pending requests", declined, processed)
+
+
+async def compact_stats_job(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue: переносит дельты счётчиков статистики в stats_counters."""
+    try:
+        await compact_stats_counters()
+    except Exception as e:
+        logger.error("Failed to compact stats counters: %s", e)
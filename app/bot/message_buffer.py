@@ -0,0 +1,96 @@
+"""Буфер входящих сообщений: пачечная запись в БД фоновой задачей."""
+
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+
+from telegram import Message
+
+from ..models import save_message, save_messages
+
+logger = logging.getLogger(__name__)
+
+# Маркер остановки: после него фоновая задача сбрасывает остаток и завершается.
+_STOP = object()
+
+
+class MessageBuffer:
+    """Копит сообщения в очереди и сбрасывает их в БД пачками.
+
+    Пачка уходит, когда набралось max_batch сообщений или прошло
+    flush_interval секунд с первого сообщения пачки.
+    """
+
+    def __init__(self, max_batch: int = 1000, flush_interval: float = 0.2):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        # Принятые, но ещё не обработанные _flush сообщения
+        self._unsaved = 0
+
+    @property
+    def pending(self) -> int:
+        """Сколько сообщений ещё не записано (в очереди и в текущей пачке)."""
+        return self._unsaved
+
+    def start(self):
+        """Запускает фоновую задачу записи."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="message_buffer")
+
+    async def stop(self):
+        """Сбрасывает накопленные сообщения и останавливает задачу."""
+        if self._task is None:
+            return
+        self._queue.put_nowait(_STOP)
+        await self._task
+        self._task = None
+
+    def put(self, msg: Message, is_edit: bool = False):
+        """Ставит сообщение в очередь на запись (не блокирует)."""
+        self._queue.put_nowait((msg, is_edit))
+        self._unsaved += 1
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+
+            batch: List[Tuple[Message, bool]] = [item]
+            stopping = False
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+            self._unsaved -= len(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch: List[Tuple[Message, bool]]):
+        try:
+            await save_messages(batch)
+            logger.info("Saved batch of %s messages", len(batch))
+            return
+        except Exception as e:
+            logger.error("Failed to save batch of %s messages: %s", len(batch), e)
+
+        # Пачка откатилась целиком — пишем по одному, чтобы не терять остальные
+        for msg, is_edit in batch:
+            try:
+                await save_message(msg, is_edit=is_edit)
+            except Exception as e:
+                logger.error("Failed to save message %s: %s", msg.message_id, e)
@@ -0,0 +1,80 @@
+"""Простые in-process кэши с временем жизни записей."""
+
+import asyncio
+import functools
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """LRU-кэш, записи которого устаревают через ttl секунд.
+
+    Не потокобезопасен — рассчитан на использование из одного event loop.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Возвращает значение или None, если записи нет или она устарела."""
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        """Сохраняет значение, вытесняя самую давнюю запись при переполнении."""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        """Удаляет запись, если она есть."""
+        self._data.pop(key, None)
+
+    def clear(self):
+        """Очищает кэш."""
+        self._data.clear()
+
+
+def async_ttl_cache(ttl: float):
+    """Декоратор: кэширует результат корутинной функции на ttl секунд.
+
+    Ключ — аргументы вызова. Одновременные вызовы с одинаковыми аргументами
+    ждут один и тот же запрос (coalescing). Ошибка и отмена не кэшируются.
+    """
+    def decorator(func):
+        entries: Dict[Hashable, Tuple[float, asyncio.Future]] = {}
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            now = time.monotonic()
+            entry = entries.get(key)
+            if entry is None or entry[0] <= now:
+                task = asyncio.ensure_future(func(*args, **kwargs))
+                entries[key] = entry = (now + ttl, task)
+
+                def drop_failed(done: asyncio.Future, key=key):
+                    if done.cancelled() or done.exception() is not None:
+                        if entries.get(key, (None, None))[1] is done:
+                            del entries[key]
+
+                task.add_done_callback(drop_failed)
+
+            # shield: отмена одного из ожидающих не отменяет общий запрос
+            return await asyncio.shield(entry[1])
+
+        wrapper.cache_clear = entries.clear
+        return wrapper
+
+    return decorator
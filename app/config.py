@@ -1,11 +1,12 @@
 """Конфигурация приложения через переменные окружения."""
 
+import functools
 import os
 from dataclasses import dataclass
 from typing import Optional
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Config:
     """Конфигурация приложения."""
 
@@ -14,6 +15,14 @@ class Config:
     port: int = 8000
     log_level: str = "INFO"
 
+    # Пул соединений к БД
+    db_pool_min_size: int = 5
+    db_pool_max_size: int = 32
+
+    # Пачечная запись сообщений (MessageBuffer)
+    message_batch_size: int = 1000
+    message_flush_interval_ms: int = 200
+
     # Опциональная базовая авторизация для админки
     admin_username: Optional[str] = None
     admin_password: Optional[str] = None
@@ -48,6 +57,10 @@ class Config:
             database_url=database_url,
             port=int(os.getenv("PORT", "8000")),
             log_level=os.getenv("LOG_LEVEL", "INFO"),
+            db_pool_min_size=int(os.getenv("DB_POOL_MIN_SIZE", "5")),
+            db_pool_max_size=int(os.getenv("DB_POOL_MAX_SIZE", "32")),
+            message_batch_size=int(os.getenv("MESSAGE_BATCH_SIZE", "1000")),
+            message_flush_interval_ms=int(os.getenv("MESSAGE_FLUSH_INTERVAL_MS", "200")),
             admin_username=os.getenv("ADMIN_USERNAME"),
             admin_password=os.getenv("ADMIN_PASSWORD"),
             openrouter_api_key=os.getenv("OPENROUTER_API_KEY"),
@@ -73,13 +86,7 @@ class Config:
         return bool(self.openrouter_api_key)
 
 
-# Глобальный экземпляр конфигурации
-config: Optional[Config] = None
-
-
+@functools.cache
 def get_config() -> Config:
-    """Возвращает глобальную конфигурацию."""
-    global config
-    if config is None:
-        config = Config.from_env()
-    return config
+    """Возвращает глобальную конфигурацию (загружается один раз)."""
+    return Config.from_env()
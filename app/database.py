@@ -4,16 +4,48 @@ import logging
 from typing import Optional
 from contextlib import asynccontextmanager
 
+import orjson
+from psycopg import AsyncConnection
+from psycopg.rows import RowFactory
+from psycopg.types.json import set_json_dumps, set_json_loads
 from psycopg_pool import AsyncConnectionPool
 
 logger = logging.getLogger(__name__)
 
+
+def _json_dumps(obj) -> bytes:
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+# JSON/JSONB-параметры (raw_message каждого сообщения, кэш и т.п.) кодируются
+# через orjson — сразу в bytes, без промежуточной str; JSONB-колонки
+# в результатах разбираются им же
+set_json_dumps(_json_dumps)
+set_json_loads(orjson.loads)
+
 # Глобальный пул соединений
 _pool: Optional[AsyncConnectionPool] = None
 
 
-async def init_pool(database_url: str, min_size: int = 1, max_size: int = 10) -> AsyncConnectionPool:
-    """Инициализирует пул соединений к базе данных."""
+async def _configure_connection(conn: AsyncConnection):
+    """Настраивает новое соединение пула.
+
+    jit=off: запросы бота короткие, JIT-компиляция плана стоит дороже,
+    чем экономит на выполнении.
+    """
+    await conn.execute("SET jit = off")
+    await conn.commit()
+
+
+async def init_pool(database_url: str, min_size: int = 5, max_size: int = 32) -> AsyncConnectionPool:
+    """Инициализирует пул соединений к базе данных.
+
+    prepare_threshold=0: psycopg готовит серверные prepared statements
+    с первого выполнения запроса, повторные INSERT/SELECT не планируются заново.
+
+    После открытия ждём, пока пул установит min_size соединений, — первые
+    запросы после старта не платят за подключение и аутентификацию.
+    """
     global _pool
     
     logger.info("Initializing database connection pool...")
@@ -21,9 +53,15 @@ async def init_pool(database_url: str, min_size: int = 1, max_size: int = 10) ->
         database_url,
         min_size=min_size,
         max_size=max_size,
+        max_idle=300,
+        timeout=10,
+        reconnect_timeout=5,
+        kwargs={"prepare_threshold": 0},
+        configure=_configure_connection,
         open=False
     )
     await _pool.open()
+    await _pool.wait(timeout=10)
     logger.info("Database connection pool initialized successfully")
     return _pool
 
@@ -53,8 +91,30 @@ async def get_connection():
 
 
 @asynccontextmanager
-async def get_cursor():
-    """Контекстный менеджер для получения курсора."""
+async def get_cursor(binary: bool = True, row_factory: Optional[RowFactory] = None):
+    """Контекстный менеджер для получения курсора.
+
+    По умолчанию результаты читаются в бинарном формате. Для скриптов из
+    нескольких statement'ов (схема, миграции) нужен binary=False: бинарный
+    формат работает только через extended protocol, а он не принимает
+    несколько команд в одном запросе.
+
+    row_factory=dict_row: строки сразу приходят словарями с ключами
+    по именам колонок.
+    """
     async with get_connection() as conn:
-        async with conn.cursor() as cur:
+        async with conn.cursor(binary=binary, row_factory=row_factory) as cur:
             yield cur
+
+
+@asynccontextmanager
+async def get_pipeline():
+    """Контекстный менеджер для курсора в pipeline-режиме.
+
+    Запросы, выполненные через этот курсор, отправляются серверу пачкой
+    и не ждут ответа друг друга.
+    """
+    async with get_connection() as conn:
+        async with conn.pipeline():
+            async with conn.cursor(binary=True) as cur:
+                yield cur
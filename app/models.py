@@ -1,14 +1,17 @@
 """Модели и SQL запросы для работы с данными."""
 
-import json
 import logging
+from collections import OrderedDict
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, AsyncIterator
 from dataclasses import dataclass
 
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
 from telegram import User, Chat, Message, MessageOriginChat, MessageOriginChannel
 
-from .database import get_cursor, get_connection
+from .cache import TTLCache, async_ttl_cache
+from .database import get_cursor, get_connection, get_pipeline
 
 logger = logging.getLogger(__name__)
 
@@ -76,8 +79,12 @@ CREATE TABLE IF NOT EXISTS join_requests (
 );
 
 -- Индексы для оптимизации запросов (кроме message_type - создаётся после миграций)
-CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages(chat_id);
-CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages(user_id);
+-- (chat_id, sent_at DESC): выборки сообщений чата по времени и ORDER BY sent_at DESC LIMIT
+-- идут по индексу без сортировки; заменяет одиночный индекс по chat_id
+CREATE INDEX IF NOT EXISTS idx_messages_chat_sent ON messages(chat_id, sent_at DESC);
+-- (user_id, sent_at DESC): подсчёт сообщений по пользователям и выборки
+-- по автору; заменяет одиночный индекс по user_id (нужен и для FK)
+CREATE INDEX IF NOT EXISTS idx_messages_user_sent ON messages(user_id, sent_at DESC);
 CREATE INDEX IF NOT EXISTS idx_messages_sent_at ON messages(sent_at);
 CREATE INDEX IF NOT EXISTS idx_chats_username ON chats(username) WHERE username IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_users_username ON users(username) WHERE username IS NOT NULL;
@@ -85,6 +92,15 @@ CREATE INDEX IF NOT EXISTS idx_users_username ON users(username) WHERE username
 CREATE INDEX IF NOT EXISTS idx_join_requests_chat_status ON join_requests(chat_id, status);
 CREATE INDEX IF NOT EXISTS idx_join_requests_user_id ON join_requests(user_id);
 CREATE INDEX IF NOT EXISTS idx_join_requests_request_date ON join_requests(request_date);
+
+-- Кэш ответов LLM (OpenRouter): переживает перезапуски процесса
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key BYTEA PRIMARY KEY,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    expires_at TIMESTAMPTZ NOT NULL
+);
 """
 
 # SQL для миграции существующих таблиц
@@ -137,65 +153,227 @@ END $$;
 
 -- Создаём индекс для message_type если его нет
 CREATE INDEX IF NOT EXISTS idx_messages_type ON messages(message_type);
+
+-- Одиночные индексы покрываются составными (их первая колонка та же):
+-- idx_messages_chat_id -> idx_messages_chat_sent, idx_messages_user_id -> idx_messages_user_sent
+DROP INDEX IF EXISTS idx_messages_chat_id;
+DROP INDEX IF EXISTS idx_messages_user_id;
+"""
+
+# Счётчики для get_stats: вместо COUNT(*) по всей таблице на каждый запрос
+# держим готовые числа. Statement-level триггеры не обновляют общую строку,
+# а дописывают дельту в stats_counter_deltas: параллельные транзакции записи
+# не ждут друг друга на одной строке и не могут на ней взаимно заблокироваться.
+# get_stats складывает stats_counters и дельты; compact_stats_counters
+# периодически переносит дельты в stats_counters.
+STATS_COUNTERS_SQL = """
+CREATE TABLE IF NOT EXISTS stats_counters (
+    scope TEXT PRIMARY KEY,
+    total_chats BIGINT NOT NULL DEFAULT 0,
+    total_users BIGINT NOT NULL DEFAULT 0,
+    total_messages BIGINT NOT NULL DEFAULT 0,
+    by_type JSONB NOT NULL DEFAULT '{}'
+);
+
+CREATE TABLE IF NOT EXISTS stats_counter_deltas (
+    total_chats BIGINT NOT NULL DEFAULT 0,
+    total_users BIGINT NOT NULL DEFAULT 0,
+    total_messages BIGINT NOT NULL DEFAULT 0,
+    by_type JSONB NOT NULL DEFAULT '{}'
+);
+
+-- users/chats: TG_ARGV[0] — имя колонки-счётчика
+CREATE OR REPLACE FUNCTION stats_count_rows() RETURNS trigger AS $$
+DECLARE
+    n BIGINT;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT COUNT(*) INTO n FROM new_rows;
+    ELSE
+        SELECT -COUNT(*) INTO n FROM old_rows;
+    END IF;
+    IF n <> 0 THEN
+        EXECUTE format('INSERT INTO stats_counter_deltas (%I) VALUES ($1)', TG_ARGV[0]) USING n;
+    END IF;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION stats_count_messages() RETURNS trigger AS $$
+DECLARE
+    delta JSONB;
+    n BIGINT;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT jsonb_object_agg(message_type, cnt), SUM(cnt) INTO delta, n
+        FROM (SELECT message_type, COUNT(*) AS cnt FROM new_rows GROUP BY message_type) t;
+    ELSE
+        SELECT jsonb_object_agg(message_type, -cnt), -SUM(cnt) INTO delta, n
+        FROM (SELECT message_type, COUNT(*) AS cnt FROM old_rows GROUP BY message_type) t;
+    END IF;
+    IF n IS NOT NULL THEN
+        INSERT INTO stats_counter_deltas (total_messages, by_type) VALUES (n, delta);
+    END IF;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+-- Переносит накопленные дельты в stats_counters. DELETE ... RETURNING забирает
+-- только закоммиченные к началу запроса дельты, новые дождутся следующего
+-- вызова; читатели видят либо дельты, либо уже обновлённую строку.
+CREATE OR REPLACE FUNCTION stats_compact_deltas() RETURNS void AS $$
+BEGIN
+    WITH moved AS (
+        DELETE FROM stats_counter_deltas
+        RETURNING total_chats, total_users, total_messages, by_type
+    ), totals AS (
+        SELECT
+            COALESCE(SUM(total_chats), 0) AS total_chats,
+            COALESCE(SUM(total_users), 0) AS total_users,
+            COALESCE(SUM(total_messages), 0) AS total_messages,
+            COUNT(*) AS n
+        FROM moved
+    ), types AS (
+        SELECT t.key, SUM(t.value::bigint) AS cnt
+        FROM moved, jsonb_each_text(moved.by_type) AS t
+        GROUP BY t.key
+    )
+    UPDATE stats_counters s SET
+        total_chats = s.total_chats + totals.total_chats,
+        total_users = s.total_users + totals.total_users,
+        total_messages = s.total_messages + totals.total_messages,
+        by_type = s.by_type || COALESCE((
+            SELECT jsonb_object_agg(types.key, COALESCE((s.by_type ->> types.key)::bigint, 0) + types.cnt)
+            FROM types
+        ), '{}')
+    FROM totals
+    WHERE s.scope = 'global' AND totals.n > 0;
+END $$ LANGUAGE plpgsql;
+
+-- При INSERT ... ON CONFLICT в new_rows попадают только реально вставленные строки.
+-- Триггеры создаются, только если их нет: DROP/CREATE TRIGGER на каждом старте
+-- брал бы ACCESS EXCLUSIVE на таблицы до конца транзакции схемы, и при
+-- rolling deploy работа старого инстанса вставала бы в очередь за ним.
+-- Тела функций обновляет CREATE OR REPLACE FUNCTION выше, без блокировки таблиц.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                   WHERE tgrelid = 'chats'::regclass AND tgname = 'trg_stats_chats_insert') THEN
+        CREATE TRIGGER trg_stats_chats_insert AFTER INSERT ON chats
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION stats_count_rows('total_chats');
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                   WHERE tgrelid = 'chats'::regclass AND tgname = 'trg_stats_chats_delete') THEN
+        CREATE TRIGGER trg_stats_chats_delete AFTER DELETE ON chats
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION stats_count_rows('total_chats');
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                   WHERE tgrelid = 'users'::regclass AND tgname = 'trg_stats_users_insert') THEN
+        CREATE TRIGGER trg_stats_users_insert AFTER INSERT ON users
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION stats_count_rows('total_users');
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                   WHERE tgrelid = 'users'::regclass AND tgname = 'trg_stats_users_delete') THEN
+        CREATE TRIGGER trg_stats_users_delete AFTER DELETE ON users
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION stats_count_rows('total_users');
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                   WHERE tgrelid = 'messages'::regclass AND tgname = 'trg_stats_messages_insert') THEN
+        CREATE TRIGGER trg_stats_messages_insert AFTER INSERT ON messages
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION stats_count_messages();
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                   WHERE tgrelid = 'messages'::regclass AND tgname = 'trg_stats_messages_delete') THEN
+        CREATE TRIGGER trg_stats_messages_delete AFTER DELETE ON messages
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION stats_count_messages();
+    END IF;
+END $$;
+
+-- Первичное заполнение — один раз, в той же транзакции, что и первое создание
+-- триггеров: CREATE TRIGGER блокирует запись в таблицы до её конца, вставки
+-- не проскочат мимо.
+INSERT INTO stats_counters (scope, total_chats, total_users, total_messages, by_type)
+SELECT
+    'global',
+    (SELECT COUNT(*) FROM chats),
+    (SELECT COUNT(*) FROM users),
+    (SELECT COUNT(*) FROM messages),
+    COALESCE((
+        SELECT jsonb_object_agg(message_type, cnt)
+        FROM (SELECT message_type, COUNT(*) AS cnt FROM messages GROUP BY message_type) t
+    ), '{}')
+WHERE NOT EXISTS (SELECT 1 FROM stats_counters WHERE scope = 'global')
+ON CONFLICT (scope) DO NOTHING;
 """
 
 
 async def create_tables():
     """Создает таблицы в базе данных."""
-    async with get_cursor() as cur:
-        await cur.execute(CREATE_TABLES_SQL)
+    async with get_cursor(binary=False) as cur:
+        # prepare=False: многокомандный скрипт нельзя подготовить на сервере
+        await cur.execute(CREATE_TABLES_SQL, prepare=False)
         logger.info("Database tables created/verified")
 
 
 async def run_migrations():
     """Запускает миграции для обновления схемы."""
-    async with get_cursor() as cur:
-        await cur.execute(MIGRATION_SQL)
+    async with get_cursor(binary=False) as cur:
+        await cur.execute(MIGRATION_SQL, prepare=False)
         logger.info("Database migrations completed")
 
 
 async def init_database():
-    """Инициализирует базу данных: создаёт таблицы и запускает миграции."""
-    # Сначала создаём базовые таблицы
-    await create_tables()
-    # Затем запускаем миграции (добавляют новые колонки)
-    await run_migrations()
-    # Создаём индекс на message_type после миграций
-    async with get_cursor() as cur:
-        await cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_type ON messages(message_type);")
-        logger.info("Message type index created/verified")
+    """Инициализирует базу данных: создаёт таблицы и запускает миграции.
+
+    Все шаги идут через одно соединение в одной транзакции: схема
+    либо обновляется целиком, либо остаётся как была.
+    """
+    async with get_connection() as conn:
+        async with conn.transaction():
+            async with conn.cursor(binary=False) as cur:
+                # Сначала создаём базовые таблицы
+                await cur.execute(CREATE_TABLES_SQL, prepare=False)
+                logger.info("Database tables created/verified")
+                # Затем запускаем миграции (добавляют новые колонки
+                # и создают индекс на message_type)
+                await cur.execute(MIGRATION_SQL, prepare=False)
+                logger.info("Database migrations completed")
+                # Счётчики статистики группируют по message_type — тоже после миграций
+                await cur.execute(STATS_COUNTERS_SQL, prepare=False)
+                logger.info("Stats counters created/verified")
+
+
+# Порядок проверки важен: у анимаций Telegram заполняет и document,
+# поэтому они, как и раньше, определяются как document. Тип = имя атрибута.
+_MESSAGE_TYPE_ATTRS = (
+    "text",
+    "photo",
+    "video",
+    "audio",
+    "voice",
+    "video_note",
+    "document",
+    "sticker",
+    "animation",
+    "poll",
+    "location",
+    "contact",
+    "dice",
+)
 
 
 def detect_message_type(msg: Message) -> str:
     """Определяет тип сообщения."""
-    if msg.text:
-        return "text"
-    elif msg.photo:
-        return "photo"
-    elif msg.video:
-        return "video"
-    elif msg.audio:
-        return "audio"
-    elif msg.voice:
-        return "voice"
-    elif msg.video_note:
-        return "video_note"
-    elif msg.document:
-        return "document"
-    elif msg.sticker:
-        return "sticker"
-    elif msg.animation:
-        return "animation"
-    elif msg.poll:
-        return "poll"
-    elif msg.location:
-        return "location"
-    elif msg.contact:
-        return "contact"
-    elif msg.dice:
-        return "dice"
-    else:
-        return "other"
+    for attr in _MESSAGE_TYPE_ATTRS:
+        if getattr(msg, attr):
+            return attr
+    return "other"
 
 
 def get_forward_chat_id(msg: Message) -> Optional[int]:
@@ -218,99 +396,276 @@ def get_forward_chat_id(msg: Message) -> Optional[int]:
     return None
 
 
+UPSERT_USER_SQL = """
+    INSERT INTO users (id, is_bot, first_name, last_name, username, language_code, is_premium, last_updated_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
+    ON CONFLICT (id) DO UPDATE SET
+        first_name = EXCLUDED.first_name,
+        last_name = EXCLUDED.last_name,
+        username = EXCLUDED.username,
+        language_code = EXCLUDED.language_code,
+        is_premium = EXCLUDED.is_premium,
+        last_updated_at = NOW()
+    -- Без изменений строку не трогаем: ни новой версии кортежа, ни WAL
+    WHERE (users.first_name, users.last_name, users.username, users.language_code, users.is_premium)
+          IS DISTINCT FROM
+          (EXCLUDED.first_name, EXCLUDED.last_name, EXCLUDED.username, EXCLUDED.language_code, EXCLUDED.is_premium);
+"""
+
+UPSERT_CHAT_SQL = """
+    INSERT INTO chats (id, type, title, username)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (id) DO UPDATE SET
+        title = EXCLUDED.title,
+        username = EXCLUDED.username,
+        last_updated_at = NOW()
+    WHERE (chats.title, chats.username) IS DISTINCT FROM (EXCLUDED.title, EXCLUDED.username);
+"""
+
+
+def _user_row(user: User) -> tuple:
+    """Параметры UPSERT_USER_SQL."""
+    return (
+        user.id,
+        user.is_bot,
+        user.first_name,
+        user.last_name,
+        user.username,
+        user.language_code,
+        getattr(user, 'is_premium', False) or False,
+    )
+
+
+def _chat_row(chat: Chat) -> tuple:
+    """Параметры UPSERT_CHAT_SQL."""
+    return (
+        chat.id,
+        chat.type,
+        chat.title,
+        chat.username,
+    )
+
+
+# Последние сохранённые в этом процессе строки users/chats (id -> параметры UPSERT).
+# Почти все сообщения приходят от уже виденных пользователей с теми же данными —
+# повторный UPSERT только берёт блокировку строки и пишет WAL ради last_updated_at.
+_SAVED_CACHE_SIZE = 100_000
+_saved_users: "OrderedDict[int, tuple]" = OrderedDict()
+_saved_chats: "OrderedDict[int, tuple]" = OrderedDict()
+
+# Недавно сохранённые сообщения ((chat_id, message_id) -> True). После
+# переподключения Telegram доставляет часть сообщений повторно — их
+# отбрасываем до сериализации raw_message и запросов к БД
+RECENT_MESSAGES_CACHE_SIZE = 10_000
+RECENT_MESSAGES_CACHE_TTL = 60
+_recent_messages = TTLCache(maxsize=RECENT_MESSAGES_CACHE_SIZE, ttl=RECENT_MESSAGES_CACHE_TTL)
+
+# Кэш get_chat_by_id (см. там же)
+CHAT_BY_ID_CACHE_TTL = 30
+_chat_by_id_cache = TTLCache(maxsize=256, ttl=CHAT_BY_ID_CACHE_TTL)
+
+
+def _is_saved(cache: "OrderedDict[int, tuple]", row: tuple) -> bool:
+    """Проверяет, сохранена ли уже строка с такими же данными."""
+    if cache.get(row[0]) == row:
+        cache.move_to_end(row[0])
+        return True
+    return False
+
+
+def _mark_saved(cache: "OrderedDict[int, tuple]", row: Optional[tuple]):
+    """Запоминает сохранённую строку. Вызывать только после коммита:
+    иначе после отката в кэше остался бы id, которого нет в БД."""
+    if row is None:
+        return
+    cache[row[0]] = row
+    cache.move_to_end(row[0])
+    if len(cache) > _SAVED_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def _mark_chat_saved(row: Optional[tuple]):
+    """_mark_saved для чата: заодно сбрасывает чат в кэше get_chat_by_id."""
+    _mark_saved(_saved_chats, row)
+    if row is not None:
+        _chat_by_id_cache.pop(row[0])
+
+
+async def _save_user_sql(cur, user: User) -> Optional[tuple]:
+    """UPSERT пользователя через переданный курсор (можно внутри pipeline).
+
+    Возвращает строку для _mark_saved или None, если пользователь
+    с теми же данными уже сохранён и запрос не отправлялся.
+    """
+    row = _user_row(user)
+    if _is_saved(_saved_users, row):
+        return None
+    await cur.execute(UPSERT_USER_SQL, row)
+    return row
+
+
+async def _save_chat_sql(cur, chat: Chat) -> Optional[tuple]:
+    """UPSERT чата через переданный курсор; возвращает то же, что _save_user_sql."""
+    row = _chat_row(chat)
+    if _is_saved(_saved_chats, row):
+        return None
+    await cur.execute(UPSERT_CHAT_SQL, row)
+    return row
+
+
 async def save_user(user: User):
     """Сохраняет или обновляет пользователя."""
     async with get_cursor() as cur:
-        await cur.execute("""
-            INSERT INTO users (id, is_bot, first_name, last_name, username, language_code, is_premium, last_updated_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
-            ON CONFLICT (id) DO UPDATE SET
-                first_name = EXCLUDED.first_name,
-                last_name = EXCLUDED.last_name,
-                username = EXCLUDED.username,
-                language_code = EXCLUDED.language_code,
-                is_premium = EXCLUDED.is_premium,
-                last_updated_at = NOW();
-        """, (
-            user.id,
-            user.is_bot,
-            user.first_name,
-            user.last_name,
-            user.username,
-            user.language_code,
-            getattr(user, 'is_premium', False) or False,
-        ))
+        row = await _save_user_sql(cur, user)
+    _mark_saved(_saved_users, row)
 
 
 async def save_chat(chat: Chat):
     """Сохраняет или обновляет чат."""
     async with get_cursor() as cur:
-        await cur.execute("""
-            INSERT INTO chats (id, type, title, username)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT (id) DO UPDATE SET
-                title = EXCLUDED.title,
-                username = EXCLUDED.username,
-                last_updated_at = NOW();
-        """, (
-            chat.id,
-            chat.type,
-            chat.title,
-            chat.username,
-        ))
+        row = await _save_chat_sql(cur, chat)
+    _mark_chat_saved(row)
+
+
+MESSAGE_COLUMNS = (
+    "message_id, chat_id, user_id, message_type, text, caption, "
+    "reply_to_message_id, forward_from_chat_id, sent_at, raw_message"
+)
+
+INSERT_MESSAGE_SQL = f"""
+    INSERT INTO messages ({MESSAGE_COLUMNS})
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (chat_id, message_id) DO NOTHING;
+"""
+
+UPDATE_MESSAGE_SQL = """
+    UPDATE messages
+    SET text = %s, caption = %s, edited_at = %s, raw_message = %s
+    WHERE chat_id = %s AND message_id = %s;
+"""
+
+# Пачка новых сообщений: COPY во временную таблицу (живёт в рамках соединения,
+# очищается на commit), затем один INSERT ... ON CONFLICT DO NOTHING —
+# повторно доставленные Telegram сообщения не ломают пачку.
+CREATE_MESSAGES_STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS messages_staging
+    (LIKE messages INCLUDING DEFAULTS) ON COMMIT DELETE ROWS;
+"""
+
+COPY_MESSAGES_STAGING_SQL = f"COPY messages_staging ({MESSAGE_COLUMNS}) FROM STDIN"
+
+INSERT_MESSAGES_FROM_STAGING_SQL = f"""
+    INSERT INTO messages ({MESSAGE_COLUMNS})
+    SELECT {MESSAGE_COLUMNS} FROM messages_staging
+    ON CONFLICT (chat_id, message_id) DO NOTHING;
+"""
+
+
+def _message_row(msg: Message) -> tuple:
+    """Параметры INSERT для нового сообщения (порядок MESSAGE_COLUMNS)."""
+    return (
+        msg.message_id,
+        msg.chat_id,
+        msg.from_user.id,
+        detect_message_type(msg),
+        msg.text or None,
+        msg.caption or None,
+        msg.reply_to_message.message_id if msg.reply_to_message else None,
+        get_forward_chat_id(msg),
+        msg.date,
+        # Jsonb: psycopg сериализует dict сам и шлёт его как jsonb, без промежуточной str
+        Jsonb(msg.to_dict()),
+    )
+
+
+def _edited_message_row(msg: Message) -> tuple:
+    """Параметры UPDATE_MESSAGE_SQL для отредактированного сообщения."""
+    return (
+        msg.text or None,
+        msg.caption or None,
+        msg.edit_date,
+        Jsonb(msg.to_dict()),
+        msg.chat_id,
+        msg.message_id,
+    )
 
 
 async def save_message(msg: Message, is_edit: bool = False):
     """Сохраняет сообщение в базу данных."""
     if not msg.from_user:
         return
+    message_key = (msg.chat_id, msg.message_id)
+    if not is_edit and _recent_messages.get(message_key):
+        return
     
-    # Сохраняем пользователя и чат
-    await save_user(msg.from_user)
-    await save_chat(msg.chat)
-    
-    message_type = detect_message_type(msg)
-    text_content = msg.text or None
-    caption = msg.caption or None
-    reply_to_id = msg.reply_to_message.message_id if msg.reply_to_message else None
-    forward_chat_id = get_forward_chat_id(msg)
-    
-    async with get_cursor() as cur:
+    # Пользователь, чат и сообщение уходят одним pipeline в одной транзакции
+    async with get_pipeline() as cur:
+        user_row = await _save_user_sql(cur, msg.from_user)
+        chat_row = await _save_chat_sql(cur, msg.chat)
         if is_edit:
             # Обновляем существующее сообщение
-            await cur.execute("""
-                UPDATE messages 
-                SET text = %s, caption = %s, edited_at = %s, raw_message = %s
-                WHERE chat_id = %s AND message_id = %s;
-            """, (
-                text_content,
-                caption,
-                msg.edit_date,
-                json.dumps(msg.to_dict()),
-                msg.chat_id,
-                msg.message_id,
-            ))
+            await cur.execute(UPDATE_MESSAGE_SQL, _edited_message_row(msg))
         else:
             # Вставляем новое сообщение
-            await cur.execute("""
-                INSERT INTO messages (
-                    message_id, chat_id, user_id, message_type, text, caption,
-                    reply_to_message_id, forward_from_chat_id, sent_at, raw_message
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (chat_id, message_id) DO NOTHING;
-            """, (
-                msg.message_id,
-                msg.chat_id,
-                msg.from_user.id,
-                message_type,
-                text_content,
-                caption,
-                reply_to_id,
-                forward_chat_id,
-                msg.date,
-                json.dumps(msg.to_dict()),
-            ))
+            await cur.execute(INSERT_MESSAGE_SQL, _message_row(msg))
+    
+    _mark_saved(_saved_users, user_row)
+    _mark_chat_saved(chat_row)
+    if not is_edit:
+        _recent_messages.set(message_key, True)
+
+
+async def save_messages(items: List[Tuple[Message, bool]]):
+    """Сохраняет пачку сообщений: items — пары (сообщение, is_edit).
+
+    Новые сообщения пишутся через COPY, правки применяются после них
+    в той же транзакции.
+    """
+    items = [
+        (msg, is_edit) for msg, is_edit in items
+        if msg.from_user
+        and (is_edit or not _recent_messages.get((msg.chat_id, msg.message_id)))
+    ]
+    if not items:
+        return
+
+    # В пачке один и тот же пользователь/чат встречается много раз —
+    # upsert'им каждого один раз, с самыми свежими данными
+    users = {msg.from_user.id: msg.from_user for msg, _ in items}
+    chats = {msg.chat.id: msg.chat for msg, _ in items}
+    # Сортировка по id — строки блокируются в одном порядке
+    # во всех транзакциях, без взаимных блокировок
+    user_rows = [_user_row(users[i]) for i in sorted(users)]
+    user_rows = [row for row in user_rows if not _is_saved(_saved_users, row)]
+    chat_rows = [_chat_row(chats[i]) for i in sorted(chats)]
+    chat_rows = [row for row in chat_rows if not _is_saved(_saved_chats, row)]
+
+    new_rows = [_message_row(msg) for msg, is_edit in items if not is_edit]
+    edit_rows = [_edited_message_row(msg) for msg, is_edit in items if is_edit]
+
+    async with get_connection() as conn:
+        async with conn.transaction():
+            async with conn.cursor() as cur:
+                # executemany отправляет строки пачкой (pipeline), без RTT на каждую
+                if user_rows:
+                    await cur.executemany(UPSERT_USER_SQL, user_rows)
+                if chat_rows:
+                    await cur.executemany(UPSERT_CHAT_SQL, chat_rows)
+                if new_rows:
+                    await cur.execute(CREATE_MESSAGES_STAGING_SQL)
+                    async with cur.copy(COPY_MESSAGES_STAGING_SQL) as copy:
+                        for row in new_rows:
+                            await copy.write_row(row)
+                    await cur.execute(INSERT_MESSAGES_FROM_STAGING_SQL)
+                for row in edit_rows:
+                    await cur.execute(UPDATE_MESSAGE_SQL, row)
+
+    for row in user_rows:
+        _mark_saved(_saved_users, row)
+    for row in chat_rows:
+        _mark_chat_saved(row)
+    for row in new_rows:
+        _recent_messages.set((row[1], row[0]), True)
 
 
 async def save_join_request_fields(
@@ -329,12 +684,12 @@ async def save_join_request_fields(
     If user/chat objects are provided, we also upsert them into users/chats tables
     so FK constraints on join_requests are satisfied.
     """
-    if user is not None:
-        await save_user(user)
-    if chat is not None:
-        await save_chat(chat)
-
-    async with get_cursor() as cur:
+    user_row = chat_row = None
+    async with get_pipeline() as cur:
+        if user is not None:
+            user_row = await _save_user_sql(cur, user)
+        if chat is not None:
+            chat_row = await _save_chat_sql(cur, chat)
         await cur.execute(
             """
             INSERT INTO join_requests (user_id, chat_id, username, first_name, bio, request_date, status)
@@ -350,12 +705,15 @@ async def save_join_request_fields(
             (user_id, chat_id, username, first_name, bio, request_date),
         )
         row = await cur.fetchone()
-        return int(row[0]) if row else None
+
+    _mark_saved(_saved_users, user_row)
+    _mark_chat_saved(chat_row)
+    return int(row[0]) if row else None
 
 
 async def get_pending_fresh_join_requests(chat_id: int, min_user_id: int, limit: int) -> List[Dict[str, Any]]:
     """Get pending join requests for chat with user_id >= threshold."""
-    async with get_cursor() as cur:
+    async with get_cursor(row_factory=dict_row) as cur:
         await cur.execute(
             """
             SELECT id, user_id, chat_id, username, first_name, request_date
@@ -368,32 +726,65 @@ async def get_pending_fresh_join_requests(chat_id: int, min_user_id: int, limit:
             """,
             (chat_id, min_user_id, limit),
         )
-        rows = await cur.fetchall()
+        return await cur.fetchall()
 
-    return [
-        {
-            "id": row[0],
-            "user_id": row[1],
-            "chat_id": row[2],
-            "username": row[3],
-            "first_name": row[4],
-            "request_date": row[5],
-        }
-        for row in rows
+
+# Max ids per UPDATE statement: keeps each array parameter and lock set bounded.
+_STATUS_UPDATE_CHUNK = 1000
+
+MARK_JOIN_REQUESTS_STATUS_SQL = """
+    UPDATE join_requests AS jr
+    SET status = %s
+    FROM unnest(%s::bigint[]) AS u(id)
+    WHERE jr.id = u.id;
+"""
+
+
+async def mark_join_requests_statuses(ids_by_status: Dict[str, List[int]]) -> None:
+    """Update join_requests.status for several statuses in one pipelined round-trip.
+
+    ids are joined via unnest() so large sets can use a hash/merge join
+    instead of an ANY() scan; they are sent in chunks of _STATUS_UPDATE_CHUNK,
+    all within one transaction.
+    """
+    batches = [
+        (status, ids[i:i + _STATUS_UPDATE_CHUNK])
+        for status, ids in ids_by_status.items()
+        for i in range(0, len(ids), _STATUS_UPDATE_CHUNK)
     ]
+    if not batches:
+        return
 
+    async with get_pipeline() as cur:
+        for status, ids in batches:
+            await cur.execute(MARK_JOIN_REQUESTS_STATUS_SQL, (status, ids))
+
+
+_JOIN_REQUESTS_SELECT = """
+    SELECT
+        id,
+        user_id,
+        chat_id,
+        username,
+        first_name,
+        bio,
+        request_date,
+        status,
+        created_at
+    FROM join_requests
+    WHERE chat_id = %s
+"""
 
-async def mark_join_requests_status(ids: List[int], status: str) -> int:
-    """Update join_requests.status for given primary keys, return updated count."""
-    if not ids:
-        return 0
+# Both filter variants are fixed strings, so each is prepared once and reused.
+# A single "(%s IS NULL OR status = %s)" text would get a worse generic plan.
+JOIN_REQUESTS_SQL = _JOIN_REQUESTS_SELECT + """
+    ORDER BY request_date DESC LIMIT %s OFFSET %s
+"""
 
-    async with get_cursor() as cur:
-        await cur.execute(
-            "UPDATE join_requests SET status = %s WHERE id = ANY(%s::bigint[]);",
-            (status, ids),
-        )
-        return int(cur.rowcount or 0)
+JOIN_REQUESTS_BY_STATUS_SQL = _JOIN_REQUESTS_SELECT + """
+      AND status = %s
+    ORDER BY request_date DESC LIMIT %s OFFSET %s
+"""
 
 
 async def get_join_requests(
@@ -403,47 +794,12 @@ async def get_join_requests(
     status: Optional[str] = None,
 ) -> List[Dict[str, Any]]:
     """Get join requests for a chat (for admin/API inspection)."""
-    async with get_cursor() as cur:
-        query = """
-            SELECT
-                id,
-                user_id,
-                chat_id,
-                username,
-                first_name,
-                bio,
-                request_date,
-                status,
-                created_at
-            FROM join_requests
-            WHERE chat_id = %s
-        """
-        params: List[Any] = [chat_id]
-
+    async with get_cursor(row_factory=dict_row) as cur:
         if status:
-            query += " AND status = %s"
-            params.append(status)
-
-        query += " ORDER BY request_date DESC LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
-
-        await cur.execute(query, params)
-        rows = await cur.fetchall()
-
-    return [
-        {
-            "id": row[0],
-            "user_id": row[1],
-            "chat_id": row[2],
-            "username": row[3],
-            "first_name": row[4],
-            "bio": row[5],
-            "request_date": row[6],
-            "status": row[7],
-            "created_at": row[8],
-        }
-        for row in rows
-    ]
+            await cur.execute(JOIN_REQUESTS_BY_STATUS_SQL, (chat_id, status, limit, offset))
+        else:
+            await cur.execute(JOIN_REQUESTS_SQL, (chat_id, limit, offset))
+        return await cur.fetchall()
 
 
 # ========== Запросы для админки ==========
@@ -471,59 +827,112 @@ class Stats:
     messages_by_type: Dict[str, int]
 
 
+# Агрегаты для дашборда и API переиспользуются несколько секунд:
+# частый опрос страницы не повторяет их на каждый запрос
+STATS_CACHE_TTL = 5
+
+
+@async_ttl_cache(STATS_CACHE_TTL)
 async def get_stats() -> Stats:
-    """Получает общую статистику."""
+    """Получает общую статистику.
+
+    Итоговые счётчики — stats_counters плюс ещё не перенесённые дельты
+    (их пишут триггеры), по messages считается только сегодняшний диапазон.
+    """
     async with get_cursor() as cur:
-        # Общие счётчики
-        await cur.execute("SELECT COUNT(*) FROM chats")
-        total_chats = (await cur.fetchone())[0]
-        
-        await cur.execute("SELECT COUNT(*) FROM users")
-        total_users = (await cur.fetchone())[0]
-        
-        await cur.execute("SELECT COUNT(*) FROM messages")
-        total_messages = (await cur.fetchone())[0]
-        
         await cur.execute("""
-            SELECT COUNT(*) FROM messages 
-            WHERE sent_at >= CURRENT_DATE
+            SELECT
+                c.total_chats + d.total_chats,
+                c.total_users + d.total_users,
+                c.total_messages + d.total_messages,
+                (SELECT COUNT(*) FROM messages WHERE sent_at >= CURRENT_DATE),
+                c.by_type,
+                (
+                    SELECT jsonb_object_agg(t.key, t.cnt)
+                    FROM (
+                        SELECT e.key, SUM(e.value::bigint) AS cnt
+                        FROM stats_counter_deltas, jsonb_each_text(by_type) AS e
+                        GROUP BY e.key
+                    ) t
+                )
+            FROM stats_counters c, (
+                -- SUM(bigint) даёт numeric — приводим, чтобы итог остался int
+                SELECT
+                    COALESCE(SUM(total_chats), 0)::bigint AS total_chats,
+                    COALESCE(SUM(total_users), 0)::bigint AS total_users,
+                    COALESCE(SUM(total_messages), 0)::bigint AS total_messages
+                FROM stats_counter_deltas
+            ) d
+            WHERE c.scope = 'global'
         """)
-        messages_today = (await cur.fetchone())[0]
+        row = await cur.fetchone()
         
-        # Сообщения по типам
-        await cur.execute("""
-            SELECT message_type, COUNT(*) as cnt 
-            FROM messages 
-            GROUP BY message_type 
-            ORDER BY cnt DESC
-        """)
-        messages_by_type = {row[0]: row[1] for row in await cur.fetchall()}
+        if not row:
+            return Stats(
+                total_chats=0,
+                total_users=0,
+                total_messages=0,
+                messages_today=0,
+                messages_by_type={},
+            )
+        
+        by_type = dict(row[4])
+        for message_type, cnt in (row[5] or {}).items():
+            by_type[message_type] = by_type.get(message_type, 0) + cnt
+
+        # jsonb не хранит порядок ключей; обнулившиеся типы не показываем
+        messages_by_type = {
+            message_type: cnt
+            for message_type, cnt in sorted(by_type.items(), key=lambda item: item[1], reverse=True)
+            if cnt
+        }
         
         return Stats(
-            total_chats=total_chats,
-            total_users=total_users,
-            total_messages=total_messages,
-            messages_today=messages_today,
+            total_chats=row[0],
+            total_users=row[1],
+            total_messages=row[2],
+            messages_today=row[3],
             messages_by_type=messages_by_type,
         )
 
 
+async def compact_stats_counters():
+    """Переносит накопленные дельты счётчиков в stats_counters.
+
+    Вызывается периодически: дельт немного, и get_stats суммирует их быстро.
+    """
+    async with get_cursor() as cur:
+        await cur.execute("SELECT stats_compact_deltas()")
+
+
+@async_ttl_cache(STATS_CACHE_TTL)
 async def get_chats_with_stats() -> List[ChatStats]:
     """Получает список чатов со статистикой."""
     async with get_cursor() as cur:
         await cur.execute("""
+            -- Агрегаты считаются по messages один раз и только потом
+            -- соединяются с chats. message_id уникален в чате (PK) —
+            -- COUNT(*) без DISTINCT; DISTINCT остаётся только для user_id.
+            WITH m AS (
+                SELECT
+                    chat_id,
+                    COUNT(*) AS message_count,
+                    COUNT(DISTINCT user_id) AS user_count,
+                    MAX(sent_at) AS last_message_at
+                FROM messages
+                GROUP BY chat_id
+            )
             SELECT 
                 c.id,
                 c.type,
                 c.title,
                 c.username,
-                COUNT(DISTINCT m.message_id) as message_count,
-                COUNT(DISTINCT m.user_id) as user_count,
-                MAX(m.sent_at) as last_message_at,
+                COALESCE(m.message_count, 0) as message_count,
+                COALESCE(m.user_count, 0) as user_count,
+                m.last_message_at,
                 c.first_seen_at
             FROM chats c
-            LEFT JOIN messages m ON c.id = m.chat_id
-            GROUP BY c.id, c.type, c.title, c.username, c.first_seen_at
+            LEFT JOIN m ON m.chat_id = c.id
             ORDER BY message_count DESC
         """)
         
@@ -543,16 +952,9 @@ async def get_chats_with_stats() -> List[ChatStats]:
         ]
 
 
-async def get_chat_messages(
-    chat_id: int, 
-    limit: int = 100, 
-    offset: int = 0,
-    message_type: Optional[str] = None
-) -> List[Dict[str, Any]]:
-    """Получает сообщения чата."""
-    async with get_cursor() as cur:
-        query = """
-            SELECT 
+# Колонки сообщения с автором; user_* собираются во вложенный "user"
+# в _nest_message_user. Текст запроса при этом остаётся константным.
+MESSAGE_WITH_USER_COLUMNS = """
                 m.message_id,
                 m.message_type,
                 m.text,
@@ -560,169 +962,217 @@ async def get_chat_messages(
                 m.sent_at,
                 m.edited_at,
                 m.reply_to_message_id,
-                u.id as user_id,
-                u.first_name,
-                u.last_name,
-                u.username
-            FROM messages m
-            LEFT JOIN users u ON m.user_id = u.id
-            WHERE m.chat_id = %s
-        """
-        params = [chat_id]
-        
+                u.id AS user_id,
+                u.first_name AS user_first_name,
+                u.last_name AS user_last_name,
+                u.username AS user_username"""
+
+
+def _nest_message_user(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Переносит колонки user_* строки (dict_row) во вложенный словарь "user"."""
+    user = {
+        "id": row.pop("user_id"),
+        "first_name": row.pop("user_first_name"),
+        "last_name": row.pop("user_last_name"),
+        "username": row.pop("user_username"),
+    }
+    row["user"] = user if user["id"] else None
+    return row
+
+
+_CHAT_MESSAGES_SELECT = f"""
+    SELECT 
+        {MESSAGE_WITH_USER_COLUMNS}
+    FROM messages m
+    LEFT JOIN users u ON m.user_id = u.id
+    WHERE m.chat_id = %s
+"""
+
+# Два фиксированных варианта текста — каждый готовится на сервере один раз.
+# Один запрос с "(%s IS NULL OR m.message_type = %s)" получил бы generic-план,
+# который не умеет пользоваться фильтром по типу.
+CHAT_MESSAGES_SQL = _CHAT_MESSAGES_SELECT + """
+    ORDER BY m.sent_at DESC LIMIT %s OFFSET %s
+"""
+
+CHAT_MESSAGES_BY_TYPE_SQL = _CHAT_MESSAGES_SELECT + """
+      AND m.message_type = %s
+    ORDER BY m.sent_at DESC LIMIT %s OFFSET %s
+"""
+
+
+# Keyset-пагинация страницы чата: следующая страница выбирается условием
+# по (sent_at, message_id) последней показанной строки, а не OFFSET —
+# глубокие страницы не пропускают offset строк. Отдельное sent_at <=/>=
+# даёт условие по индексу (chat_id, sent_at); сравнение строк
+# досравнивает message_id среди сообщений с одинаковым sent_at.
+# Варианты текста фиксированы (по типу и направлению), как и выше.
+_KEYSET_CONDITIONS = {
+    None: ("", "DESC"),
+    "before": ("""
+      AND m.sent_at <= %s AND (m.sent_at, m.message_id) < (%s, %s)""", "DESC"),
+    "after": ("""
+      AND m.sent_at >= %s AND (m.sent_at, m.message_id) > (%s, %s)""", "ASC"),
+}
+
+CHAT_MESSAGES_PAGE_SQL = {
+    (by_type, direction): (
+        _CHAT_MESSAGES_SELECT
+        + ("""
+      AND m.message_type = %s""" if by_type else "")
+        + condition
+        + f"""
+    ORDER BY m.sent_at {order}, m.message_id {order} LIMIT %s
+"""
+    )
+    for by_type in (False, True)
+    for direction, (condition, order) in _KEYSET_CONDITIONS.items()
+}
+
+
+async def get_chat_messages(
+    chat_id: int, 
+    limit: int = 100, 
+    offset: int = 0,
+    message_type: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """Получает сообщения чата."""
+    async with get_cursor(row_factory=dict_row) as cur:
         if message_type:
-            query += " AND m.message_type = %s"
-            params.append(message_type)
-        
-        query += " ORDER BY m.sent_at DESC LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
-        
-        await cur.execute(query, params)
+            await cur.execute(CHAT_MESSAGES_BY_TYPE_SQL, (chat_id, message_type, limit, offset))
+        else:
+            await cur.execute(CHAT_MESSAGES_SQL, (chat_id, limit, offset))
         rows = await cur.fetchall()
         
-        return [
-            {
-                "message_id": row[0],
-                "message_type": row[1],
-                "text": row[2],
-                "caption": row[3],
-                "sent_at": row[4],
-                "edited_at": row[5],
-                "reply_to_message_id": row[6],
-                "user": {
-                    "id": row[7],
-                    "first_name": row[8],
-                    "last_name": row[9],
-                    "username": row[10],
-                } if row[7] else None
-            }
-            for row in rows
-        ]
+        return [_nest_message_user(row) for row in rows]
+
+
+async def get_chat_messages_page(
+    chat_id: int,
+    limit: int = 50,
+    message_type: Optional[str] = None,
+    before: Optional[Tuple[datetime, int]] = None,
+    after: Optional[Tuple[datetime, int]] = None,
+) -> List[Dict[str, Any]]:
+    """Страница сообщений чата (новые первые) по keyset-курсору.
+
+    before=(sent_at, message_id) — сообщения старше этой строки (следующая
+    страница), after — новее неё (предыдущая страница). Без курсора —
+    самые новые сообщения.
+    """
+    direction = "before" if before else "after" if after else None
+    cursor = before or after
+
+    params: List[Any] = [chat_id]
+    if message_type:
+        params.append(message_type)
+    if cursor:
+        params.extend((cursor[0], cursor[0], cursor[1]))
+    params.append(limit)
+
+    async with get_cursor(row_factory=dict_row) as cur:
+        await cur.execute(CHAT_MESSAGES_PAGE_SQL[bool(message_type), direction], params)
+        rows = await cur.fetchall()
+
+    if direction == "after":
+        rows.reverse()
+    return [_nest_message_user(row) for row in rows]
+
+
+async def iter_chat_messages(
+    chat_id: int,
+    limit: int = 100,
+    offset: int = 0,
+    message_type: Optional[str] = None,
+    page_size: int = 1000,
+) -> AsyncIterator[Dict[str, Any]]:
+    """То же, что get_chat_messages, но отдаёт сообщения потоком.
+
+    Строки читаются серверным курсором страницами по page_size —
+    большой limit не собирается в памяти целиком. Используйте
+    contextlib.aclosing, чтобы соединение вернулось в пул при обрыве.
+    """
+    async with get_connection() as conn:
+        async with conn.cursor("chat_messages", binary=True, row_factory=dict_row) as cur:
+            cur.itersize = page_size
+            if message_type:
+                await cur.execute(CHAT_MESSAGES_BY_TYPE_SQL, (chat_id, message_type, limit, offset))
+            else:
+                await cur.execute(CHAT_MESSAGES_SQL, (chat_id, limit, offset))
+
+            async for row in cur:
+                yield _nest_message_user(row)
 
 
 async def get_chat_by_id(chat_id: int) -> Optional[Dict[str, Any]]:
-    """Получает информацию о чате по ID."""
-    async with get_cursor() as cur:
+    """Получает информацию о чате по ID.
+
+    Найденный чат кэшируется на CHAT_BY_ID_CACHE_TTL секунд: страница чата
+    и сервисы саммари/аналитики/стратегии запрашивают его на каждый вызов.
+    Запись чата в этом процессе сбрасывает его из кэша (_mark_chat_saved).
+    """
+    cached = _chat_by_id_cache.get(chat_id)
+    if cached is not None:
+        return dict(cached)
+
+    async with get_cursor(row_factory=dict_row) as cur:
         await cur.execute("""
             SELECT id, type, title, username, first_seen_at, last_updated_at
             FROM chats WHERE id = %s
         """, (chat_id,))
-        row = await cur.fetchone()
-        
-        if not row:
-            return None
-        
-        return {
-            "id": row[0],
-            "type": row[1],
-            "title": row[2],
-            "username": row[3],
-            "first_seen_at": row[4],
-            "last_updated_at": row[5],
-        }
+        chat = await cur.fetchone()
 
-
-async def get_chat_messages_by_date(
-    chat_id: int,
-    date_str: str,  # format: YYYY-MM-DD
-) -> List[Dict[str, Any]]:
-    """Получает все сообщения чата за конкретный календарный день (UTC+3)."""
-    async with get_cursor() as cur:
-        # UTC+3: день начинается в 00:00 UTC+3 = 21:00 UTC предыдущего дня
-        await cur.execute("""
-            SELECT 
-                m.message_id,
-                m.message_type,
-                m.text,
-                m.caption,
-                m.sent_at,
-                m.edited_at,
-                m.reply_to_message_id,
-                u.id as user_id,
-                u.first_name,
-                u.last_name,
-                u.username
-            FROM messages m
-            LEFT JOIN users u ON m.user_id = u.id
-            WHERE m.chat_id = %s
-              AND (m.sent_at AT TIME ZONE 'UTC' AT TIME ZONE 'Europe/Moscow')::date = %s::date
-            ORDER BY m.sent_at ASC
-        """, (chat_id, date_str))
-        
-        rows = await cur.fetchall()
-        return [
-            {
-                "message_id": row[0],
-                "message_type": row[1],
-                "text": row[2],
-                "caption": row[3],
-                "sent_at": row[4],
-                "edited_at": row[5],
-                "reply_to_message_id": row[6],
-                "user": {
-                    "id": row[7],
-                    "first_name": row[8],
-                    "last_name": row[9],
-                    "username": row[10],
-                } if row[7] else None
-            }
-            for row in rows
-        ]
+    if chat is not None:
+        _chat_by_id_cache.set(chat_id, chat)
+        return dict(chat)
+    return None
 
 
 async def get_chat_messages_by_date_range(
     chat_id: int,
     date_from: str,  # format: YYYY-MM-DD
     date_to: str,    # format: YYYY-MM-DD
-) -> List[Dict[str, Any]]:
-    """Получает все сообщения чата за диапазон дат (включительно, UTC+3)."""
-    async with get_cursor() as cur:
-        await cur.execute("""
-            SELECT
-                m.message_id,
-                m.message_type,
-                m.text,
-                m.caption,
-                m.sent_at,
-                m.edited_at,
-                m.reply_to_message_id,
-                u.id as user_id,
-                u.first_name,
-                u.last_name,
-                u.username
-            FROM messages m
-            LEFT JOIN users u ON m.user_id = u.id
-            WHERE m.chat_id = %s
-              AND (m.sent_at AT TIME ZONE 'UTC' AT TIME ZONE 'Europe/Moscow')::date >= %s::date
-              AND (m.sent_at AT TIME ZONE 'UTC' AT TIME ZONE 'Europe/Moscow')::date <= %s::date
-            ORDER BY m.sent_at ASC
-        """, (chat_id, date_from, date_to))
+    page_size: int = 1000,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Отдаёт сообщения чата за диапазон дат (включительно, UTC+3) потоком.
+
+    Экспорт за несколько дней может быть очень большим, поэтому строки
+    читаются серверным (именованным) курсором страницами по page_size
+    и не накапливаются ни на сервере, ни в процессе. Соединение занято,
+    пока итерация не закончится — используйте contextlib.aclosing.
+    """
+    async with get_connection() as conn:
+        async with conn.cursor(
+            "messages_by_date_range", binary=True, row_factory=dict_row
+        ) as cur:
+            cur.itersize = page_size
+            # Диапазон [начало date_from, начало дня после date_to) по Москве
+            await cur.execute(f"""
+                SELECT
+                    {MESSAGE_WITH_USER_COLUMNS}
+                FROM messages m
+                LEFT JOIN users u ON m.user_id = u.id
+                WHERE m.chat_id = %s
+                  AND m.sent_at >= %s::date::timestamp AT TIME ZONE 'Europe/Moscow'
+                  AND m.sent_at < (%s::date + 1)::timestamp AT TIME ZONE 'Europe/Moscow'
+                ORDER BY m.sent_at ASC
+            """, (chat_id, date_from, date_to))
 
-        rows = await cur.fetchall()
-        return [
-            {
-                "message_id": row[0],
-                "message_type": row[1],
-                "text": row[2],
-                "caption": row[3],
-                "sent_at": row[4],
-                "edited_at": row[5],
-                "reply_to_message_id": row[6],
-                "user": {
-                    "id": row[7],
-                    "first_name": row[8],
-                    "last_name": row[9],
-                    "username": row[10],
-                } if row[7] else None
-            }
-            for row in rows
-        ]
+            async for row in cur:
+                yield _nest_message_user(row)
 
 
 async def get_users(limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
     """Получает список пользователей."""
-    async with get_cursor() as cur:
+    async with get_cursor(row_factory=dict_row) as cur:
         await cur.execute("""
+            -- Считаем по messages отдельно (index-only по idx_messages_user_sent),
+            -- а не группируем широкий join по всем колонкам users
+            WITH cnt AS (
+                SELECT user_id, COUNT(*) AS message_count
+                FROM messages
+                GROUP BY user_id
+            )
             SELECT 
                 u.id,
                 u.first_name,
@@ -732,30 +1182,13 @@ async def get_users(limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
                 u.is_premium,
                 u.language_code,
                 u.first_seen_at,
-                COUNT(m.message_id) as message_count
+                COALESCE(cnt.message_count, 0) as message_count
             FROM users u
-            LEFT JOIN messages m ON u.id = m.user_id
-            GROUP BY u.id, u.first_name, u.last_name, u.username, 
-                     u.is_bot, u.is_premium, u.language_code, u.first_seen_at
+            LEFT JOIN cnt ON cnt.user_id = u.id
             ORDER BY message_count DESC
             LIMIT %s OFFSET %s
         """, (limit, offset))
-        
-        rows = await cur.fetchall()
-        return [
-            {
-                "id": row[0],
-                "first_name": row[1],
-                "last_name": row[2],
-                "username": row[3],
-                "is_bot": row[4],
-                "is_premium": row[5],
-                "language_code": row[6],
-                "first_seen_at": row[7],
-                "message_count": row[8],
-            }
-            for row in rows
-        ]
+        return await cur.fetchall()
 
 
 @dataclass
@@ -772,72 +1205,87 @@ class DashboardChat:
 
 
 async def get_dashboard_data() -> List[DashboardChat]:
-    """Получает данные для дашборда: чаты с полной статистикой."""
+    """Получает данные для дашборда: чаты с полной статистикой.
+
+    Всё собирается одним запросом вместо двух запросов на каждый чат.
+    """
     async with get_cursor() as cur:
-        # Получаем чаты с базовой статистикой
         await cur.execute("""
+            WITH counts AS (
+                SELECT
+                    chat_id,
+                    COUNT(*) AS total_messages,
+                    COUNT(*) FILTER (WHERE sent_at >= CURRENT_DATE) AS today_messages
+                FROM messages
+                GROUP BY chat_id
+            ),
+            -- Топ-3 пользователей за неделю по всем чатам за один проход
+            ranked_users AS (
+                SELECT
+                    m.chat_id,
+                    COALESCE(u.username, u.first_name, 'Unknown') AS name,
+                    COUNT(*) AS cnt,
+                    ROW_NUMBER() OVER (PARTITION BY m.chat_id ORDER BY COUNT(*) DESC) AS rn
+                FROM messages m
+                JOIN users u ON m.user_id = u.id
+                WHERE m.sent_at >= NOW() - INTERVAL '7 days'
+                GROUP BY m.chat_id, u.id, u.username, u.first_name
+            ),
+            top_users AS (
+                SELECT
+                    chat_id,
+                    jsonb_agg(jsonb_build_object('name', name, 'count', cnt) ORDER BY rn) AS top_users
+                FROM ranked_users
+                WHERE rn <= 3
+                GROUP BY chat_id
+            )
             SELECT
                 c.id,
                 c.title,
-                COUNT(m.message_id) as total_messages,
-                COUNT(m.message_id) FILTER (WHERE m.sent_at >= CURRENT_DATE) as today_messages
+                COALESCE(cnt.total_messages, 0) AS total_messages,
+                COALESCE(cnt.today_messages, 0) AS today_messages,
+                lm.text,
+                lm.author,
+                lm.sent_at,
+                COALESCE(tu.top_users, '[]'::jsonb)
             FROM chats c
-            LEFT JOIN messages m ON c.id = m.chat_id
-            GROUP BY c.id, c.title
-            ORDER BY total_messages DESC
-        """)
-        chats_data = await cur.fetchall()
-
-        result = []
-        for chat_row in chats_data:
-            chat_id = chat_row[0]
-
-            # Последнее сообщение
-            await cur.execute("""
+            LEFT JOIN counts cnt ON cnt.chat_id = c.id
+            LEFT JOIN top_users tu ON tu.chat_id = c.id
+            -- Последнее сообщение: LIMIT 1 по idx_messages_chat_sent,
+            -- несколько записей индекса на чат вместо полного прохода
+            LEFT JOIN LATERAL (
                 SELECT
                     m.text,
-                    COALESCE(u.username, u.first_name, 'Unknown') as author,
+                    COALESCE(u.username, u.first_name, 'Unknown') AS author,
                     m.sent_at
                 FROM messages m
                 LEFT JOIN users u ON m.user_id = u.id
-                WHERE m.chat_id = %s AND m.text IS NOT NULL
+                WHERE m.chat_id = c.id AND m.text IS NOT NULL
                 ORDER BY m.sent_at DESC
                 LIMIT 1
-            """, (chat_id,))
-            last_msg = await cur.fetchone()
+            ) lm ON TRUE
+            ORDER BY total_messages DESC
+        """)
+        rows = await cur.fetchall()
 
-            # Топ пользователей за неделю
-            await cur.execute("""
-                SELECT
-                    COALESCE(u.username, u.first_name, 'Unknown') as name,
-                    COUNT(*) as count
-                FROM messages m
-                JOIN users u ON m.user_id = u.id
-                WHERE m.chat_id = %s
-                  AND m.sent_at >= NOW() - INTERVAL '7 days'
-                GROUP BY u.id, u.username, u.first_name
-                ORDER BY count DESC
-                LIMIT 3
-            """, (chat_id,))
-            top_users = [{"name": row[0], "count": row[1]} for row in await cur.fetchall()]
-
-            result.append(DashboardChat(
-                id=chat_row[0],
-                title=chat_row[1],
-                total_messages=chat_row[2],
-                today_messages=chat_row[3],
-                last_message_text=last_msg[0] if last_msg else None,
-                last_message_author=last_msg[1] if last_msg else None,
-                last_message_at=last_msg[2] if last_msg else None,
-                top_users=top_users,
-            ))
-
-        return result
+        return [
+            DashboardChat(
+                id=row[0],
+                title=row[1],
+                total_messages=row[2],
+                today_messages=row[3],
+                last_message_text=row[4],
+                last_message_author=row[5],
+                last_message_at=row[6],
+                top_users=row[7],
+            )
+            for row in rows
+        ]
 
 
 async def get_messages_for_summary(chat_id: int, limit: int = 500) -> List[Dict[str, Any]]:
     """Получает сообщения за последние 24 часа для генерации саммари."""
-    async with get_cursor() as cur:
+    async with get_cursor(row_factory=dict_row) as cur:
         await cur.execute("""
             SELECT
                 m.text,
@@ -851,33 +1299,25 @@ async def get_messages_for_summary(chat_id: int, limit: int = 500) -> List[Dict[
             ORDER BY m.sent_at ASC
             LIMIT %s
         """, (chat_id, limit))
-
-        rows = await cur.fetchall()
-        return [
-            {"text": row[0], "author": row[1], "sent_at": row[2]}
-            for row in rows
-        ]
+        return await cur.fetchall()
 
 
 async def get_daily_message_counts(chat_id: int, days: int = 7) -> List[Dict[str, Any]]:
     """Получает количество сообщений по дням за последние N дней."""
-    async with get_cursor() as cur:
-        await cur.execute(f"""
+    async with get_cursor(row_factory=dict_row) as cur:
+        # Период передаётся параметром, а не вшивается в текст запроса:
+        # SQL остаётся одним и тем же, и prepared statement переиспользуется
+        await cur.execute("""
             SELECT
-                (m.sent_at AT TIME ZONE 'UTC' AT TIME ZONE 'Europe/Moscow')::date as day,
+                to_char((m.sent_at AT TIME ZONE 'Europe/Moscow')::date, 'YYYY-MM-DD') as date,
                 COUNT(*) as count
             FROM messages m
             WHERE m.chat_id = %s
-              AND m.sent_at >= NOW() - INTERVAL '{days} days'
-            GROUP BY day
-            ORDER BY day ASC
-        """, (chat_id,))
-
-        rows = await cur.fetchall()
-        return [
-            {"date": row[0].isoformat(), "count": row[1]}
-            for row in rows
-        ]
+              AND m.sent_at >= NOW() - make_interval(days => %s)
+            GROUP BY 1
+            ORDER BY 1 ASC
+        """, (chat_id, days))
+        return await cur.fetchall()
 
 
 async def get_messages_for_period(
@@ -885,31 +1325,61 @@ async def get_messages_for_period(
     days: int,
     limit: int = 500
 ) -> List[Dict[str, Any]]:
-    """Получает сообщения за указанный период для анализа."""
+    """Получает последние limit сообщений за указанный период для анализа.
+
+    Сообщения возвращаются в хронологическом порядке (старые первые).
+    """
+    async with get_cursor(row_factory=dict_row) as cur:
+        # Последние limit сообщений выбираются по убыванию (по индексу),
+        # а в хронологический порядок переставляются на сервере —
+        # вызывающему коду не нужно разворачивать список
+        await cur.execute("""
+            SELECT text, author, sent_at, type
+            FROM (
+                SELECT
+                    COALESCE(m.text, m.caption) as text,
+                    COALESCE(u.username, u.first_name, 'Unknown') as author,
+                    m.sent_at,
+                    m.message_type as type
+                FROM messages m
+                LEFT JOIN users u ON m.user_id = u.id
+                WHERE m.chat_id = %s
+                  AND m.sent_at >= NOW() - make_interval(days => %s)
+                  AND (m.text IS NOT NULL OR m.caption IS NOT NULL)
+                ORDER BY m.sent_at DESC
+                LIMIT %s
+            ) latest
+            ORDER BY sent_at ASC
+        """, (chat_id, days, limit))
+        return await cur.fetchall()
+
+
+# ========== Кэш LLM ==========
+
+async def get_llm_cache(key: bytes) -> Optional[str]:
+    """Возвращает закэшированный ответ LLM, если он ещё не устарел."""
     async with get_cursor() as cur:
-        await cur.execute(f"""
-            SELECT
-                m.text,
-                m.caption,
-                COALESCE(u.username, u.first_name, 'Unknown') as author,
-                m.sent_at,
-                m.message_type
-            FROM messages m
-            LEFT JOIN users u ON m.user_id = u.id
-            WHERE m.chat_id = %s
-              AND m.sent_at >= NOW() - INTERVAL '{days} days'
-              AND (m.text IS NOT NULL OR m.caption IS NOT NULL)
-            ORDER BY m.sent_at DESC
-            LIMIT %s
-        """, (chat_id, limit))
+        await cur.execute(
+            "SELECT response FROM llm_cache WHERE key = %s AND expires_at > NOW()",
+            (key,),
+        )
+        row = await cur.fetchone()
+        return row[0] if row else None
 
-        rows = await cur.fetchall()
-        return [
-            {
-                "text": row[0] or row[1],
-                "author": row[2],
-                "sent_at": row[3],
-                "type": row[4],
-            }
-            for row in rows
-        ]
+
+async def save_llm_cache(key: bytes, model: str, response: str, ttl_sec: int):
+    """Сохраняет ответ LLM и заодно удаляет устаревшие записи."""
+    async with get_pipeline() as cur:
+        await cur.execute(
+            """
+            INSERT INTO llm_cache (key, model, response, expires_at)
+            VALUES (%s, %s, %s, NOW() + make_interval(secs => %s))
+            ON CONFLICT (key) DO UPDATE SET
+                model = EXCLUDED.model,
+                response = EXCLUDED.response,
+                created_at = NOW(),
+                expires_at = EXCLUDED.expires_at
+            """,
+            (key, model, response, ttl_sec),
+        )
+        await cur.execute("DELETE FROM llm_cache WHERE expires_at <= NOW()")
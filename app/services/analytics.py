@@ -1,23 +1,24 @@
 """Сервис аналитики активности чатов."""
 
+import asyncio
 import logging
-from datetime import datetime, timedelta
+from datetime import date, datetime
 from typing import Dict, Any, List
+from zoneinfo import ZoneInfo
 
 from ..models import get_daily_message_counts, get_chat_by_id
 from .openrouter import generate_completion
 
 logger = logging.getLogger(__name__)
 
+# Дни считаются по Москве — так же, как группирует get_daily_message_counts
+MOSCOW_TZ = ZoneInfo("Europe/Moscow")
+
 ANALYTICS_SYSTEM_PROMPT = """Ты — аналитик активности чата. Даёшь краткие, фактические комментарии по статистике сообщений."""
 
-ANALYTICS_PROMPT_TEMPLATE = """Дай краткий комментарий (2-3 предложения) по статистике сообщений за неделю.
-
-Тип чата: {chat_type}
-Период: {date_from} — {date_to}
-Данные по дням: {daily_data}
-Всего сообщений: {total}
-Среднее в день: {average:.1f}
+# Инструкция статична и идёт первой — кэшируемый префикс промпта;
+# статистика передаётся отдельным блоком после неё
+ANALYTICS_PROMPT = """Дай краткий комментарий (2-3 предложения) по статистике сообщений за неделю (данные ниже).
 
 Укажи:
 - Где пики и спады активности
@@ -25,36 +26,20 @@ ANALYTICS_PROMPT_TEMPLATE = """Дай краткий комментарий (2-3
 
 Будь лаконичен, максимум 50 слов."""
 
+ANALYTICS_DATA_TEMPLATE = """Тип чата: {chat_type}
+Период: {date_from} — {date_to}
+Данные по дням: {daily_data}
+Всего сообщений: {total}
+Среднее в день: {average:.1f}"""
+
 
 def _fill_missing_days(daily_counts: List[Dict[str, Any]], days: int = 7) -> List[Dict[str, Any]]:
-    """Заполняет пропущенные дни нулями."""
-    if not daily_counts:
-        # Если нет данных, создаём пустой массив за последние N дней
-        result = []
-        today = datetime.now().date()
-        for i in range(days - 1, -1, -1):
-            day = today - timedelta(days=i)
-            result.append({"date": day.isoformat(), "count": 0})
-        return result
-
-    # Создаём словарь существующих данных
+    """Заполняет пропущенные дни нулями (последние days дней по Москве, включая сегодня)."""
     existing = {item["date"]: item["count"] for item in daily_counts}
+    first = datetime.now(MOSCOW_TZ).date().toordinal() - days + 1
 
-    # Определяем диапазон дат
-    today = datetime.now().date()
-    start_date = today - timedelta(days=days - 1)
-
-    result = []
-    current = start_date
-    while current <= today:
-        date_str = current.isoformat()
-        result.append({
-            "date": date_str,
-            "count": existing.get(date_str, 0)
-        })
-        current += timedelta(days=1)
-
-    return result
+    dates = [date.fromordinal(ordinal).isoformat() for ordinal in range(first, first + days)]
+    return [{"date": date_str, "count": existing.get(date_str, 0)} for date_str in dates]
 
 
 async def generate_chat_analytics(chat_id: int) -> Dict[str, Any]:
@@ -63,8 +48,11 @@ async def generate_chat_analytics(chat_id: int) -> Dict[str, Any]:
     Returns:
         Dict с полями: success, chat_type, period, daily_messages, total, average, ai_comment, error
     """
-    # Получаем информацию о чате
-    chat = await get_chat_by_id(chat_id)
+    # Чат и статистика по дням запрашиваются параллельно
+    chat, daily_counts = await asyncio.gather(
+        get_chat_by_id(chat_id),
+        get_daily_message_counts(chat_id, days=7),
+    )
     if not chat:
         return {
             "success": False,
@@ -73,9 +61,6 @@ async def generate_chat_analytics(chat_id: int) -> Dict[str, Any]:
 
     chat_type = chat.get("type", "group")
 
-    # Получаем статистику по дням
-    daily_counts = await get_daily_message_counts(chat_id, days=7)
-
     # Заполняем пропущенные дни
     daily_messages = _fill_missing_days(daily_counts, days=7)
 
@@ -107,7 +92,7 @@ async def generate_chat_analytics(chat_id: int) -> Dict[str, Any]:
     # Генерируем AI-комментарий
     daily_data = ", ".join([f"{d['date']}: {d['count']}" for d in daily_messages])
 
-    prompt = ANALYTICS_PROMPT_TEMPLATE.format(
+    data = ANALYTICS_DATA_TEMPLATE.format(
         chat_type="канал" if chat_type == "channel" else "группа",
         date_from=date_from,
         date_to=date_to,
@@ -118,8 +103,9 @@ async def generate_chat_analytics(chat_id: int) -> Dict[str, Any]:
 
     logger.info(f"Generating analytics for chat {chat_id}")
     ai_comment = await generate_completion(
-        prompt=prompt,
+        prompt=ANALYTICS_PROMPT,
         system_prompt=ANALYTICS_SYSTEM_PROMPT,
+        data=data,
         max_tokens=150,
         timeout=30.0,
     )
@@ -1,30 +1,193 @@
 """Клиент для OpenRouter API."""
 
+import asyncio
+import hashlib
 import logging
-from typing import Optional
+import time
+from typing import Any, Dict, List, Optional
 
 import httpx
 
+from ..cache import TTLCache
 from ..config import get_config
+from ..models import get_llm_cache, save_llm_cache
 
 logger = logging.getLogger(__name__)
 
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_BASE_URL = "https://openrouter.ai"
+OPENROUTER_COMPLETIONS_PATH = "/api/v1/chat/completions"
+
+# Общий клиент: соединения (TCP + TLS) переиспользуются между запросами,
+# HTTP/2 мультиплексирует параллельные запросы в одном соединении
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _create_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=OPENROUTER_BASE_URL,
+        http2=True,
+        timeout=httpx.Timeout(30.0, connect=5.0),
+        limits=httpx.Limits(
+            max_keepalive_connections=20,
+            max_connections=50,
+            keepalive_expiry=90,
+        ),
+    )
+
+
+# Точка кэширования префикса промпта у провайдера (OpenRouter cache_control)
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# Точные повторы запросов (обновление дашборда, повторный запуск саммари)
+# отдаются без обращения к API: сначала из памяти, затем из таблицы llm_cache,
+# которая переживает перезапуск процесса
+COMPLETION_CACHE_TTL = 3600
+_completion_cache = TTLCache(maxsize=1024, ttl=COMPLETION_CACHE_TTL)
+
+
+def _completion_cache_key(
+    model: str,
+    max_tokens: int,
+    system_prompt: Optional[str],
+    prompt: str,
+    data: Optional[str] = None,
+) -> str:
+    raw = f"{model}|{max_tokens}|{system_prompt or ''}|{prompt}|{data or ''}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# Повторы запроса: экспоненциальная пауза, либо Retry-After от сервера
+# (если он не длиннее MAX_RETRY_DELAY — иначе сразу отдаём ошибку)
+MAX_ATTEMPTS = 2
+RETRY_BACKOFF_SEC = 1.0
+MAX_RETRY_DELAY = 10.0
+
+# Circuit breaker: после BREAKER_FAILURE_THRESHOLD неудачных вызовов подряд
+# запросы BREAKER_RESET_SEC секунд не отправляются вовсе, чтобы при падении
+# OpenRouter каждый запрос из админки не ждал полный таймаут. По истечении
+# паузы пропускается ровно один пробный запрос (half-open), остальные
+# по-прежнему получают отказ; новая ошибка снова открывает breaker.
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SEC = 30.0
+_breaker_failures = 0
+_breaker_opened_at = 0.0
+_breaker_probing = False
+
+
+def _breaker_is_open() -> bool:
+    """Проверяет breaker; в half-open пропускает только первого вызвавшего."""
+    global _breaker_probing
+    if _breaker_failures < BREAKER_FAILURE_THRESHOLD:
+        return False
+    if time.monotonic() - _breaker_opened_at < BREAKER_RESET_SEC:
+        return True
+    if _breaker_probing:
+        return True
+    _breaker_probing = True
+    return False
+
+
+def _record_success():
+    global _breaker_failures, _breaker_probing
+    _breaker_failures = 0
+    _breaker_probing = False
+
+
+def _record_failure():
+    global _breaker_failures, _breaker_opened_at, _breaker_probing
+    _breaker_probing = False
+    _breaker_failures += 1
+    if _breaker_failures >= BREAKER_FAILURE_THRESHOLD:
+        _breaker_opened_at = time.monotonic()
+        logger.warning(
+            f"OpenRouter circuit breaker opened for {BREAKER_RESET_SEC:.0f}s "
+            f"after {_breaker_failures} failures"
+        )
+
+
+def _release_breaker_probe():
+    global _breaker_probing
+    _breaker_probing = False
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After в секундах (формат HTTP-даты не поддерживается)."""
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
+async def init_client() -> httpx.AsyncClient:
+    """Создаёт общий HTTP-клиент OpenRouter."""
+    global _client
+    if _client is None:
+        _client = _create_client()
+        logger.info("OpenRouter HTTP client initialized")
+    return _client
+
+
+async def close_client():
+    """Закрывает общий HTTP-клиент OpenRouter."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        logger.info("OpenRouter HTTP client closed")
+
+
+def _build_messages(
+    prompt: str,
+    system_prompt: Optional[str],
+    data: Optional[str],
+) -> List[Dict[str, Any]]:
+    """Собирает messages так, чтобы статичный префикс шёл первым.
+
+    Точка cache_control ставится на последний статичный блок (инструкцию,
+    а без data — системный промпт): провайдеры с prompt caching (Anthropic
+    и др. через OpenRouter) кэшируют весь префикс до неё. Изменчивые данные
+    идут последними, чтобы не сбивать префикс.
+    """
+    messages: List[Dict[str, Any]] = []
+
+    if data is None:
+        if system_prompt:
+            messages.append({
+                "role": "system",
+                "content": [{"type": "text", "text": system_prompt, "cache_control": CACHE_CONTROL}],
+            })
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    if system_prompt:
+        messages.append({"role": "system", "content": [{"type": "text", "text": system_prompt}]})
+    messages.append({
+        "role": "user",
+        "content": [
+            {"type": "text", "text": prompt, "cache_control": CACHE_CONTROL},
+            {"type": "text", "text": data},
+        ],
+    })
+    return messages
 
 
 async def generate_completion(
     prompt: str,
     system_prompt: Optional[str] = None,
+    data: Optional[str] = None,
     max_tokens: int = 1000,
     timeout: float = 30.0,
+    use_cache: bool = True,
 ) -> Optional[str]:
     """Генерирует ответ через OpenRouter API.
 
     Args:
-        prompt: Пользовательский промпт
+        prompt: Пользовательский промпт (статичная инструкция, если передан data)
         system_prompt: Системный промпт (опционально)
+        data: Изменчивые данные запроса, идут после кэшируемого префикса (опционально)
         max_tokens: Максимальное количество токенов в ответе
         timeout: Таймаут запроса в секундах
+        use_cache: Отдавать ответ на идентичный запрос из кэша (1 час)
 
     Returns:
         Текст ответа или None при ошибке
@@ -35,10 +198,23 @@ async def generate_completion(
         logger.warning("OpenRouter API key not configured")
         return None
 
-    messages = []
-    if system_prompt:
-        messages.append({"role": "system", "content": system_prompt})
-    messages.append({"role": "user", "content": prompt})
+    cache_key = _completion_cache_key(
+        config.openrouter_model, max_tokens, system_prompt, prompt, data
+    )
+    if use_cache:
+        cached = _completion_cache.get(cache_key)
+        if cached is None:
+            try:
+                cached = await get_llm_cache(bytes.fromhex(cache_key))
+            except Exception as e:
+                logger.warning(f"LLM cache lookup failed: {e}")
+            if cached is not None:
+                _completion_cache.set(cache_key, cached)
+        if cached is not None:
+            logger.info(f"OpenRouter cache hit, {len(cached)} chars")
+            return cached
+
+    messages = _build_messages(prompt, system_prompt, data)
 
     headers = {
         "Authorization": f"Bearer {config.openrouter_api_key}",
@@ -51,26 +227,83 @@ async def generate_completion(
         "max_tokens": max_tokens,
     }
 
+    if _breaker_is_open():
+        logger.warning("OpenRouter circuit breaker is open, skipping request")
+        return None
+
+    # Флаг выставлен только у вызова, которого breaker пропустил пробным
+    probe = _breaker_probing
+    try:
+        # Без init_client() (например, из скриптов) клиент создаётся при первом вызове
+        client = _client or await init_client()
+
+        content = await _request_completion(client, headers, payload, timeout)
+    finally:
+        # Проба, завершившаяся без вердикта (4xx, отмена), не держит half-open
+        if probe:
+            _release_breaker_probe()
+    if content is None:
+        return None
+
+    # Свежий ответ кладём в кэш и при use_cache=False
+    _completion_cache.set(cache_key, content)
     try:
-        async with httpx.AsyncClient(timeout=timeout) as client:
+        await save_llm_cache(
+            bytes.fromhex(cache_key), config.openrouter_model, content, COMPLETION_CACHE_TTL
+        )
+    except Exception as e:
+        logger.warning(f"LLM cache save failed: {e}")
+    return content
+
+
+async def _request_completion(
+    client: httpx.AsyncClient,
+    headers: Dict[str, str],
+    payload: Dict[str, Any],
+    timeout: float,
+) -> Optional[str]:
+    """Выполняет запрос к OpenRouter с повтором при 429/5xx и сетевых ошибках.
+
+    Таймаут не повторяется: попытка уже израсходовала весь бюджет времени.
+    Неудачный вызов (после всех попыток) учитывается circuit breaker'ом.
+    """
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        retry_after: Optional[float] = None
+        try:
             response = await client.post(
-                OPENROUTER_API_URL,
+                OPENROUTER_COMPLETIONS_PATH,
                 headers=headers,
                 json=payload,
+                timeout=timeout,
             )
             response.raise_for_status()
 
             data = response.json()
             content = data["choices"][0]["message"]["content"]
             logger.info(f"OpenRouter response received, {len(content)} chars")
+            _record_success()
             return content
 
-    except httpx.TimeoutException:
-        logger.error("OpenRouter request timed out")
-        return None
-    except httpx.HTTPStatusError as e:
-        logger.error(f"OpenRouter HTTP error: {e.response.status_code}")
-        return None
-    except Exception as e:
-        logger.error(f"OpenRouter error: {e}")
-        return None
+        except httpx.TimeoutException:
+            logger.error("OpenRouter request timed out")
+            _record_failure()
+            return None
+        except httpx.HTTPStatusError as e:
+            status = e.response.status_code
+            logger.error(f"OpenRouter HTTP error: {status} (attempt {attempt}/{MAX_ATTEMPTS})")
+            if status != 429 and status < 500:
+                # Ошибка запроса (ключ, модель, параметры) — повтор не поможет
+                return None
+            retry_after = _parse_retry_after(e.response.headers.get("Retry-After"))
+        except httpx.TransportError as e:
+            logger.error(f"OpenRouter connection error: {e} (attempt {attempt}/{MAX_ATTEMPTS})")
+        except Exception as e:
+            logger.error(f"OpenRouter error: {e}")
+            return None
+
+        if attempt == MAX_ATTEMPTS or (retry_after is not None and retry_after > MAX_RETRY_DELAY):
+            break
+        await asyncio.sleep(retry_after if retry_after is not None else RETRY_BACKOFF_SEC * 2 ** (attempt - 1))
+
+    _record_failure()
+    return None
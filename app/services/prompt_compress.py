@@ -0,0 +1,37 @@
+"""Сжатие текста сообщений перед отправкой в LLM."""
+
+from typing import Any, Dict, List
+
+
+def format_messages(
+    messages: List[Dict[str, Any]],
+    max_len: int,
+    with_date: bool = False,
+    with_type: bool = False,
+) -> str:
+    """Сообщения для промпта, по строке "время|автор|текст" на сообщение.
+
+    Время — "ЧЧ:ММ" (с with_date — "ДД.ММ ЧЧ:ММ"), собирается из полей datetime
+    без strftime. С with_type у медиа перед текстом ставится "[тип]".
+    Текст сжимается до обрезки, чтобы лимит max_len тратился на содержимое,
+    а не на пробелы; переводы строк внутри сообщения не ломают построчный формат.
+    """
+    lines = []
+    append = lines.append
+    for msg in messages:
+        sent_at = msg["sent_at"]
+        text = msg["text"]
+        text = " ".join(text.split())[:max_len] if text else ""
+
+        if with_date:
+            time_str = f"{sent_at.day:02d}.{sent_at.month:02d} {sent_at.hour:02d}:{sent_at.minute:02d}"
+        else:
+            time_str = f"{sent_at.hour:02d}:{sent_at.minute:02d}"
+
+        msg_type = msg.get("type", "text") if with_type else "text"
+        if msg_type != "text":
+            append(f"{time_str}|{msg['author']}|[{msg_type}] {text}")
+        else:
+            append(f"{time_str}|{msg['author']}|{text}")
+
+    return "\n".join(lines)
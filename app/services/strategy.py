@@ -1,24 +1,20 @@
 """Сервис генерации контент-стратегии для чатов."""
 
+import asyncio
 import logging
 from typing import Dict, Any, List
 
 from ..models import get_messages_for_period, get_chat_by_id
 from .openrouter import generate_completion
+from .prompt_compress import format_messages
 
 logger = logging.getLogger(__name__)
 
 STRATEGY_SYSTEM_PROMPT = """Ты — контент-стратег. Анализируешь сообщения из чатов и каналов, даёшь практичные рекомендации по контенту на русском языке."""
 
-STRATEGY_PROMPT_TEMPLATE = """Проанализируй сообщения из {chat_type_ru} за {period_ru}.
-
-Название: {chat_title}
-Тип: {chat_type_ru}
-Период: {date_range}
-Сообщений проанализировано: {count}
-
-Сообщения:
-{messages}
+# Инструкция идёт первой — кэшируемый префикс промпта (по одному варианту
+# на тип чата и период); данные чата передаются отдельным блоком после неё
+STRATEGY_PROMPT_TEMPLATE = """Проанализируй сообщения из {chat_type_ru} за {period_ru} (данные ниже).
 
 Дай отчёт на русском:
 
@@ -33,22 +29,27 @@ STRATEGY_PROMPT_TEMPLATE = """Проанализируй сообщения из
 
 Максимум 300 слов."""
 
+# Все варианты инструкции рендерятся один раз при импорте
+STRATEGY_PROMPTS = {
+    (chat_type_ru, period_ru): STRATEGY_PROMPT_TEMPLATE.format(
+        chat_type_ru=chat_type_ru, period_ru=period_ru
+    )
+    for chat_type_ru in ("канала", "группы")
+    for period_ru in ("неделю", "месяц")
+}
 
-def _format_messages_for_strategy(messages: List[Dict[str, Any]]) -> str:
-    """Форматирует сообщения для промпта стратегии."""
-    lines = []
-    for msg in messages:
-        time_str = msg["sent_at"].strftime("%d.%m %H:%M")
-        author = msg["author"]
-        text = msg["text"][:300] if msg["text"] else ""
-        msg_type = msg.get("type", "text")
+STRATEGY_DATA_TEMPLATE = """Название: {chat_title}
+Тип: {chat_type_ru}
+Период: {date_range}
+Сообщений проанализировано: {count}
+
+Сообщения (время|автор|текст):
+{messages}"""
 
-        if msg_type != "text":
-            lines.append(f"[{time_str}] @{author}: [{msg_type}] {text}")
-        else:
-            lines.append(f"[{time_str}] @{author}: {text}")
 
-    return "\n".join(lines)
+def _format_messages_for_strategy(messages: List[Dict[str, Any]]) -> str:
+    """Форматирует сообщения для промпта стратегии."""
+    return format_messages(messages, max_len=300, with_date=True, with_type=True)
 
 
 async def generate_content_strategy(chat_id: int, period: str = "week") -> Dict[str, Any]:
@@ -71,8 +72,11 @@ async def generate_content_strategy(chat_id: int, period: str = "week") -> Dict[
     days = 7 if period == "week" else 30
     period_ru = "неделю" if period == "week" else "месяц"
 
-    # Получаем информацию о чате
-    chat = await get_chat_by_id(chat_id)
+    # Чат и сообщения за период запрашиваются параллельно
+    chat, messages = await asyncio.gather(
+        get_chat_by_id(chat_id),
+        get_messages_for_period(chat_id, days=days, limit=500),
+    )
     if not chat:
         return {
             "success": False,
@@ -83,9 +87,6 @@ async def generate_content_strategy(chat_id: int, period: str = "week") -> Dict[
     chat_type_ru = "канала" if chat_type == "channel" else "группы"
     chat_title = chat.get("title") or f"Chat {chat_id}"
 
-    # Получаем сообщения за период
-    messages = await get_messages_for_period(chat_id, days=days, limit=500)
-
     if not messages:
         return {
             "success": False,
@@ -93,18 +94,18 @@ async def generate_content_strategy(chat_id: int, period: str = "week") -> Dict[
         }
 
     # Формируем диапазон дат
-    # Сообщения отсортированы по убыванию (новые первые)
-    date_from = messages[-1]["sent_at"]
-    date_to = messages[0]["sent_at"]
+    # Сообщения отсортированы хронологически (старые первые)
+    date_from = messages[0]["sent_at"]
+    date_to = messages[-1]["sent_at"]
     date_range = f"{date_from.strftime('%d.%m.%Y')} — {date_to.strftime('%d.%m.%Y')}"
 
-    # Форматируем сообщения (переворачиваем для хронологического порядка)
-    formatted_messages = _format_messages_for_strategy(list(reversed(messages)))
+    # Форматируем сообщения
+    formatted_messages = _format_messages_for_strategy(messages)
 
     # Формируем промпт
-    prompt = STRATEGY_PROMPT_TEMPLATE.format(
+    prompt = STRATEGY_PROMPTS[chat_type_ru, period_ru]
+    data = STRATEGY_DATA_TEMPLATE.format(
         chat_type_ru=chat_type_ru,
-        period_ru=period_ru,
         chat_title=chat_title,
         date_range=date_range,
         count=len(messages),
@@ -116,6 +117,7 @@ async def generate_content_strategy(chat_id: int, period: str = "week") -> Dict[
     report = await generate_completion(
         prompt=prompt,
         system_prompt=STRATEGY_SYSTEM_PROMPT,
+        data=data,
         max_tokens=800,
         timeout=45.0,
     )
@@ -1,23 +1,20 @@
 """Сервис генерации саммари по чатам."""
 
+import asyncio
 import logging
 from typing import Optional, Dict, Any, List
 
 from ..models import get_messages_for_summary, get_chat_by_id
 from .openrouter import generate_completion
+from .prompt_compress import format_messages
 
 logger = logging.getLogger(__name__)
 
 SYSTEM_PROMPT = """Ты — аналитик чатов. Анализируй сообщения из групповых чатов и создавай краткие, информативные саммари на русском языке."""
 
-SUMMARY_PROMPT_TEMPLATE = """Проанализируй сообщения из группового чата за последние сутки.
-
-Чат: {chat_title}
-Период: {date_from} — {date_to}
-Сообщений: {count}
-
-Сообщения:
-{messages}
+# Инструкция статична и идёт первой — кэшируемый префикс промпта;
+# данные чата передаются отдельным блоком после неё
+SUMMARY_PROMPT = """Проанализируй сообщения из группового чата за последние сутки (данные ниже).
 
 Дай краткое саммари на русском языке:
 1. Основные темы обсуждения (2-3 пункта)
@@ -26,16 +23,18 @@ SUMMARY_PROMPT_TEMPLATE = """Проанализируй сообщения из
 
 Будь лаконичен, максимум 200 слов."""
 
+SUMMARY_DATA_TEMPLATE = """Чат: {chat_title}
+Период: {date_from} — {date_to}
+Сообщений: {count}
+
+Сообщения (время|автор|текст):
+{messages}"""
+
 
 def format_messages_for_prompt(messages: List[Dict[str, Any]]) -> str:
     """Форматирует сообщения для промпта."""
-    lines = []
-    for msg in messages:
-        time_str = msg["sent_at"].strftime("%H:%M")
-        author = msg["author"]
-        text = msg["text"][:500]  # Ограничиваем длину одного сообщения
-        lines.append(f"[{time_str}] @{author}: {text}")
-    return "\n".join(lines)
+    # Ограничиваем длину одного сообщения
+    return format_messages(messages, max_len=500)
 
 
 async def generate_chat_summary(chat_id: int) -> Dict[str, Any]:
@@ -44,8 +43,11 @@ async def generate_chat_summary(chat_id: int) -> Dict[str, Any]:
     Returns:
         Dict с полями: success, summary, error, messages_count, period
     """
-    # Получаем информацию о чате
-    chat = await get_chat_by_id(chat_id)
+    # Чат и сообщения за 24 часа запрашиваются параллельно
+    chat, messages = await asyncio.gather(
+        get_chat_by_id(chat_id),
+        get_messages_for_summary(chat_id, limit=500),
+    )
     if not chat:
         return {
             "success": False,
@@ -55,9 +57,6 @@ async def generate_chat_summary(chat_id: int) -> Dict[str, Any]:
             "period": None,
         }
 
-    # Получаем сообщения за 24 часа
-    messages = await get_messages_for_summary(chat_id, limit=500)
-
     if not messages:
         return {
             "success": False,
@@ -74,7 +73,7 @@ async def generate_chat_summary(chat_id: int) -> Dict[str, Any]:
 
     # Формируем промпт
     formatted_messages = format_messages_for_prompt(messages)
-    prompt = SUMMARY_PROMPT_TEMPLATE.format(
+    data = SUMMARY_DATA_TEMPLATE.format(
         chat_title=chat.get("title") or f"Chat {chat_id}",
         date_from=date_from.strftime("%d.%m.%Y %H:%M"),
         date_to=date_to.strftime("%d.%m.%Y %H:%M"),
@@ -85,8 +84,9 @@ async def generate_chat_summary(chat_id: int) -> Dict[str, Any]:
     # Генерируем саммари
     logger.info(f"Generating summary for chat {chat_id}, {len(messages)} messages")
     summary = await generate_completion(
-        prompt=prompt,
+        prompt=SUMMARY_PROMPT,
         system_prompt=SYSTEM_PROMPT,
+        data=data,
         max_tokens=500,
         timeout=30.0,
     )
@@ -1,16 +1,21 @@
 """Роуты веб-приложения: админка и API."""
 
+import asyncio
 import base64
-import json
+import hmac
 import logging
-from datetime import datetime
+from contextlib import aclosing
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from functools import wraps
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
 
 from aiohttp import web
 import aiohttp_jinja2
 import jinja2
+import orjson
 
+from ..cache import async_ttl_cache
 from ..config import get_config
 
 from ..database import get_cursor
@@ -18,8 +23,9 @@ from ..models import (
     get_stats,
     get_chats_with_stats,
     get_chat_messages,
-    get_chat_messages_by_date,
+    get_chat_messages_page,
     get_chat_messages_by_date_range,
+    iter_chat_messages,
     get_chat_by_id,
     get_users,
     get_dashboard_data,
@@ -34,6 +40,21 @@ logger = logging.getLogger(__name__)
 TEMPLATES_DIR = Path(__file__).parent / "templates"
 
 
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type, Authorization",
+    "Access-Control-Max-Age": "86400",
+}
+
+# Сколько саммари генерируется параллельно в пакетном запросе
+SUMMARY_BATCH_CONCURRENCY = 8
+SUMMARY_BATCH_MAX_CHATS = 50
+
+# Порог, после которого накопленный кусок потокового ответа уходит клиенту
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
 @web.middleware
 async def cors_middleware(request: web.Request, handler):
     """CORS middleware for API endpoints."""
@@ -46,24 +67,117 @@ async def cors_middleware(request: web.Request, handler):
         except web.HTTPException as ex:
             response = ex
 
-    # Add CORS headers (allow all origins)
-    response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
-    response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization"
-    response.headers["Access-Control-Max-Age"] = "86400"
+    # Add CORS headers (allow all origins).
+    # Потоковые ответы уже отправили заголовки — они ставят CORS_HEADERS сами.
+    if not response.prepared:
+        response.headers.update(CORS_HEADERS)
 
     return response
 
 
+def json_dumps(data) -> bytes:
+    """Сериализует в JSON (UTF-8 bytes) через orjson.
+
+    Кириллица не экранируется, datetime сериализуется в ISO 8601 так же,
+    как datetime.isoformat() (naive datetime считается UTC) — обработчики
+    отдают datetime как есть; нестроковые ключи словарей приводятся к строкам.
+    """
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC)
+
+
 def json_response(data, **kwargs):
-    """JSON response с поддержкой Cyrillic (ensure_ascii=False)."""
-    return web.json_response(
-        data,
-        dumps=lambda x: json.dumps(x, ensure_ascii=False),
+    """JSON response: тело сериализуется сразу в bytes через orjson."""
+    return web.Response(
+        body=json_dumps(data),
+        content_type="application/json",
+        charset="utf-8",
         **kwargs
     )
 
 
+async def stream_messages_response(
+    request: web.Request,
+    messages: AsyncIterator[Dict[str, Any]],
+    head: Optional[Dict[str, Any]] = None,
+    count_key: Optional[str] = None,
+) -> web.StreamResponse:
+    """Стримит сообщения JSON-массивом по мере чтения из БД.
+
+    Без head ответ — сам массив; с head — объект head с ключом "messages"
+    (и count_key с числом сообщений в конце, если задан).
+
+    Первая строка читается до prepare(): ошибка запроса к БД ещё уходит
+    обработчику и превращается в обычный ответ с ошибкой. После prepare()
+    статус уже отправлен — при ошибке ответ обрывается (клиент получит
+    невалидный JSON).
+    """
+    async with aclosing(messages):
+        first = await anext(messages, None)
+
+        response = web.StreamResponse(
+            headers={"Content-Type": "application/json; charset=utf-8", **CORS_HEADERS}
+        )
+        await response.prepare(request)
+
+        if head is None:
+            parts = [b"["]
+        else:
+            parts = [json_dumps(head)[:-1], b', "messages": [']
+        size = 0
+        count = 0
+        try:
+            if first is not None:
+                parts.append(json_dumps(first))
+                count = 1
+                async for msg in messages:
+                    part = json_dumps(msg)
+                    parts.append(b", " + part)
+                    size += len(part)
+                    count += 1
+                    if size >= STREAM_CHUNK_SIZE:
+                        await response.write(b"".join(parts))
+                        parts = []
+                        size = 0
+
+            parts.append(b"]")
+            if head is not None:
+                # count известен только в конце, поэтому идёт после messages
+                if count_key:
+                    parts.append(b', "%s": %d' % (count_key.encode(), count))
+                parts.append(b"}")
+            await response.write(b"".join(parts))
+            await response.write_eof()
+        except Exception as e:
+            logger.error(f"Messages stream error ({request.path}): {e}")
+
+    return response
+
+
+@lru_cache(maxsize=64)
+def _parse_basic_auth(auth_header: str) -> Optional[Tuple[bytes, bytes]]:
+    """Разбирает заголовок Basic auth в (username, password).
+
+    Админка повторяет один и тот же заголовок на каждом запросе —
+    результат разбора кэшируется по его значению.
+    """
+    scheme, _, token = auth_header.partition(" ")
+    if scheme.lower() != "basic":
+        return None
+    try:
+        decoded = base64.b64decode(token.strip()).decode("utf-8")
+        username, password = decoded.split(":", 1)
+    except Exception:
+        return None
+    return username.encode("utf-8"), password.encode("utf-8")
+
+
+@lru_cache(maxsize=1)
+def _expected_auth_header(username: str, password: str) -> bytes:
+    """Заголовок Authorization, который отправляет браузер с верными учётными данными."""
+    token = base64.b64encode(f"{username}:{password}".encode("utf-8")).decode("ascii")
+    return f"Basic {token}".encode("ascii")
+
+
 def check_auth(request: web.Request) -> bool:
     """Проверяет базовую авторизацию."""
     config = get_config()
@@ -72,77 +186,107 @@ def check_auth(request: web.Request) -> bool:
         return True  # Авторизация не настроена
     
     auth_header = request.headers.get("Authorization", "")
-    if not auth_header.startswith("Basic "):
-        return False
-    
-    try:
-        encoded = auth_header[6:]
-        decoded = base64.b64decode(encoded).decode("utf-8")
-        username, password = decoded.split(":", 1)
-        return username == config.admin_username and password == config.admin_password
-    except Exception:
+
+    # Основной путь: заголовок сравнивается с ожидаемым в закодированном виде,
+    # без декодирования base64. compare_digest — сравнение за постоянное время
+    expected = _expected_auth_header(config.admin_username, config.admin_password)
+    if hmac.compare_digest(auth_header.encode("utf-8"), expected):
+        return True
+
+    # Иначе (другой регистр схемы, иная запись base64, неверный пароль) — разбор
+    credentials = _parse_basic_auth(auth_header)
+    if credentials is None:
         return False
 
+    username, password = credentials
+    username_ok = hmac.compare_digest(username, config.admin_username.encode("utf-8"))
+    password_ok = hmac.compare_digest(password, config.admin_password.encode("utf-8"))
+    return username_ok and password_ok
+
+
+# Пути без авторизации (healthcheck Railway)
+PUBLIC_PATHS = frozenset({"/health"})
 
-def require_auth(handler):
-    """Декоратор для проверки авторизации."""
-    @wraps(handler)
-    async def wrapper(request: web.Request):
-        if not check_auth(request):
-            return web.Response(
-                status=401,
-                headers={"WWW-Authenticate": 'Basic realm="Admin Panel"'},
-                text="Unauthorized"
-            )
-        return await handler(request)
-    return wrapper
+
+@web.middleware
+async def auth_middleware(request: web.Request, handler):
+    """Проверяет базовую авторизацию для всех путей, кроме PUBLIC_PATHS."""
+    if request.path not in PUBLIC_PATHS and not check_auth(request):
+        return web.Response(
+            status=401,
+            headers={"WWW-Authenticate": 'Basic realm="Admin Panel"'},
+            text="Unauthorized"
+        )
+    return await handler(request)
 
 
 # ========== Health Check ==========
 
-async def health_check(request: web.Request) -> web.Response:
-    """Health check endpoint для Railway."""
+# Результат проверки БД переиспользуется HEALTH_CACHE_SEC секунд:
+# частые пробы Railway не занимают соединения пула под SELECT 1.
+# Тело ответа сериализуется один раз на пробу, а не на каждый запрос
+HEALTH_CACHE_SEC = 2.0
+HEALTH_PROBE_TIMEOUT = 1.0
+
+
+async def _probe_database() -> bool:
+    # Таймаут покрывает и ожидание соединения из пула: зависшая или
+    # перегруженная БД даёт быстрый 500, а не таймаут healthcheck'а Railway
     try:
-        async with get_cursor() as cur:
-            await cur.execute("SELECT 1")
-            result = await cur.fetchone()
-        
-        if result and result[0] == 1:
-            return json_response({
-                "status": "healthy",
-                "database": "connected",
-                "timestamp": datetime.utcnow().isoformat() + "Z"
-            })
+        async with asyncio.timeout(HEALTH_PROBE_TIMEOUT):
+            async with get_cursor() as cur:
+                await cur.execute("SELECT 1")
+                result = await cur.fetchone()
+        return bool(result and result[0] == 1)
+    except TimeoutError:
+        logger.error(f"Health check failed: database did not respond in {HEALTH_PROBE_TIMEOUT}s")
+        return False
     except Exception as e:
         logger.error(f"Health check failed: {e}")
-    
-    return json_response({
-        "status": "unhealthy",
-        "database": "disconnected",
-        "timestamp": datetime.utcnow().isoformat() + "Z"
-    }, status=500)
+        return False
+
+
+@async_ttl_cache(HEALTH_CACHE_SEC)
+async def _health_status() -> Tuple[bool, bytes]:
+    """Проверяет БД и сериализует ответ /health.
+
+    async_ttl_cache объединяет одновременные вызовы: запросы, пришедшие
+    во время проверки или на границе окна, ждут ту же проверку, а не
+    запускают свою.
+    """
+    ok = await _probe_database()
+    timestamp = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+    body = json_dumps({
+        "status": "healthy" if ok else "unhealthy",
+        "database": "connected" if ok else "disconnected",
+        "timestamp": timestamp,
+    })
+    return ok, body
+
+
+async def health_check(request: web.Request) -> web.Response:
+    """Health check endpoint для Railway."""
+    ok, body = await _health_status()
+    return web.Response(
+        body=body,
+        status=200 if ok else 500,
+        content_type="application/json",
+        charset="utf-8",
+    )
 
 
 # ========== API ==========
 
-@require_auth
 async def api_stats(request: web.Request) -> web.Response:
     """API: общая статистика."""
     try:
-        stats = await get_stats()
-        return json_response({
-            "total_chats": stats.total_chats,
-            "total_users": stats.total_users,
-            "total_messages": stats.total_messages,
-            "messages_today": stats.messages_today,
-            "messages_by_type": stats.messages_by_type,
-        })
+        # Поля Stats совпадают с ответом API — orjson сериализует dataclass сам
+        return json_response(await get_stats())
     except Exception as e:
         logger.error(f"API stats error: {e}")
         return json_response({"error": str(e)}, status=500)
 
 
-@require_auth
 async def api_chats(request: web.Request) -> web.Response:
     """API: список чатов."""
     try:
@@ -155,7 +299,7 @@ async def api_chats(request: web.Request) -> web.Response:
                 "username": c.username,
                 "message_count": c.message_count,
                 "user_count": c.user_count,
-                "last_message_at": c.last_message_at.isoformat() if c.last_message_at else None,
+                "last_message_at": c.last_message_at,
             }
             for c in chats
         ])
@@ -164,7 +308,6 @@ async def api_chats(request: web.Request) -> web.Response:
         return json_response({"error": str(e)}, status=500)
 
 
-@require_auth
 async def api_chat_messages(request: web.Request) -> web.Response:
     """API: сообщения чата."""
     try:
@@ -172,23 +315,15 @@ async def api_chat_messages(request: web.Request) -> web.Response:
         limit = int(request.query.get("limit", 100))
         offset = int(request.query.get("offset", 0))
         message_type = request.query.get("type")
-        
-        messages = await get_chat_messages(chat_id, limit, offset, message_type)
-        
-        # Сериализуем datetime
-        for msg in messages:
-            if msg["sent_at"]:
-                msg["sent_at"] = msg["sent_at"].isoformat()
-            if msg["edited_at"]:
-                msg["edited_at"] = msg["edited_at"].isoformat()
-        
-        return json_response(messages)
+
+        return await stream_messages_response(
+            request, iter_chat_messages(chat_id, limit, offset, message_type)
+        )
     except Exception as e:
         logger.error(f"API chat messages error: {e}")
         return json_response({"error": str(e)}, status=500)
 
 
-@require_auth
 async def api_chat_messages_daily(request: web.Request) -> web.Response:
     """API: сообщения чата за конкретный день (UTC+3)."""
     try:
@@ -197,23 +332,18 @@ async def api_chat_messages_daily(request: web.Request) -> web.Response:
         
         if not date_str:
             return json_response({"error": "date parameter required (YYYY-MM-DD)"}, status=400)
-        
-        messages = await get_chat_messages_by_date(chat_id, date_str)
-        
-        # Сериализуем datetime
-        for msg in messages:
-            if msg["sent_at"]:
-                msg["sent_at"] = msg["sent_at"].isoformat()
-            if msg["edited_at"]:
-                msg["edited_at"] = msg["edited_at"].isoformat()
-        
-        return json_response({
-            "chat_id": chat_id,
-            "date": date_str,
-            "timezone": "UTC+3",
-            "count": len(messages),
-            "messages": messages,
-        })
+        datetime.strptime(date_str, "%Y-%m-%d")
+
+        return await stream_messages_response(
+            request,
+            get_chat_messages_by_date_range(chat_id, date_str, date_str),
+            head={
+                "chat_id": chat_id,
+                "date": date_str,
+                "timezone": "UTC+3",
+            },
+            count_key="count",
+        )
     except ValueError:
         return json_response({"error": "invalid chat_id or date format"}, status=400)
     except Exception as e:
@@ -221,7 +351,6 @@ async def api_chat_messages_daily(request: web.Request) -> web.Response:
         return json_response({"error": str(e)}, status=500)
 
 
-@require_auth
 async def api_chat_messages_export(request: web.Request) -> web.Response:
     """API: экспорт сообщений чата за диапазон дат (UTC+3)."""
     try:
@@ -257,26 +386,22 @@ async def api_chat_messages_export(request: web.Request) -> web.Response:
         if not chat:
             return json_response({"error": "chat not found"}, status=404)
 
-        messages = await get_chat_messages_by_date_range(chat_id, date_from, date_to)
-
-        # Serialize datetime
-        for msg in messages:
-            if msg["sent_at"]:
-                msg["sent_at"] = msg["sent_at"].isoformat()
-            if msg["edited_at"]:
-                msg["edited_at"] = msg["edited_at"].isoformat()
-
-        return json_response({
-            "chat_id": chat_id,
-            "chat_title": chat.get("title"),
-            "period": {
-                "from": date_from,
-                "to": date_to,
+        # Сообщения стримятся по мере чтения из БД: экспорт за большой период
+        # не собирается целиком в памяти
+        return await stream_messages_response(
+            request,
+            get_chat_messages_by_date_range(chat_id, date_from, date_to),
+            head={
+                "chat_id": chat_id,
+                "chat_title": chat.get("title"),
+                "period": {
+                    "from": date_from,
+                    "to": date_to,
+                },
+                "timezone": "UTC+3",
             },
-            "timezone": "UTC+3",
-            "messages_count": len(messages),
-            "messages": messages,
-        })
+            count_key="messages_count",
+        )
     except ValueError:
         return json_response({"error": "invalid chat_id"}, status=400)
     except Exception as e:
@@ -284,7 +409,6 @@ async def api_chat_messages_export(request: web.Request) -> web.Response:
         return json_response({"error": str(e)}, status=500)
 
 
-@require_auth
 async def api_dashboard(request: web.Request) -> web.Response:
     """API: данные для дашборда."""
     try:
@@ -301,7 +425,7 @@ async def api_dashboard(request: web.Request) -> web.Response:
                     "last_message": {
                         "text": c.last_message_text[:100] if c.last_message_text else None,
                         "author": c.last_message_author,
-                        "sent_at": c.last_message_at.isoformat() if c.last_message_at else None,
+                        "sent_at": c.last_message_at,
                     } if c.last_message_text else None,
                     "top_users_week": c.top_users,
                 }
@@ -314,7 +438,6 @@ async def api_dashboard(request: web.Request) -> web.Response:
         return json_response({"error": str(e)}, status=500)
 
 
-@require_auth
 async def api_chat_summary(request: web.Request) -> web.Response:
     """API: генерация саммари для чата."""
     try:
@@ -339,7 +462,52 @@ async def api_chat_summary(request: web.Request) -> web.Response:
         return json_response({"error": str(e)}, status=500)
 
 
-@require_auth
+async def api_dashboard_summaries(request: web.Request) -> web.Response:
+    """API: саммари для нескольких чатов одним запросом.
+
+    Body: {"chat_ids": [...]}. Запросы к OpenRouter идут параллельно
+    (не больше SUMMARY_BATCH_CONCURRENCY одновременно).
+    """
+    config = get_config()
+    if not config.has_openrouter:
+        return json_response({
+            "success": False,
+            "error": "OpenRouter API не настроен",
+        }, status=503)
+
+    try:
+        body = await request.json()
+        raw_ids = body["chat_ids"]
+        # Строка тоже итерируема: "123" превратилась бы в чаты 1, 2, 3
+        if not isinstance(raw_ids, list):
+            raise TypeError("chat_ids must be a list")
+        chat_ids = [int(chat_id) for chat_id in raw_ids]
+    except Exception:
+        return json_response({"error": "chat_ids list required"}, status=400)
+
+    # Повторы в запросе генерируются один раз
+    chat_ids = list(dict.fromkeys(chat_ids))
+    if len(chat_ids) > SUMMARY_BATCH_MAX_CHATS:
+        return json_response(
+            {"error": f"too many chat_ids, max {SUMMARY_BATCH_MAX_CHATS}"},
+            status=400
+        )
+
+    sem = asyncio.Semaphore(SUMMARY_BATCH_CONCURRENCY)
+
+    async def summarize(chat_id: int) -> Dict[str, Any]:
+        async with sem:
+            try:
+                result = await generate_chat_summary(chat_id)
+            except Exception as e:
+                logger.error(f"API batch summary error for chat {chat_id}: {e}")
+                result = {"success": False, "error": str(e)}
+        return {"chat_id": chat_id, **result}
+
+    results = await asyncio.gather(*(summarize(chat_id) for chat_id in chat_ids))
+    return json_response({"results": results})
+
+
 async def api_chat_analytics(request: web.Request) -> web.Response:
     """API: аналитика чата за неделю."""
     try:
@@ -364,7 +532,6 @@ async def api_chat_analytics(request: web.Request) -> web.Response:
         return json_response({"error": str(e)}, status=500)
 
 
-@require_auth
 async def api_chat_strategy(request: web.Request) -> web.Response:
     """API: генерация контент-стратегии для чата."""
     try:
@@ -396,7 +563,6 @@ async def api_chat_strategy(request: web.Request) -> web.Response:
         return json_response({"error": str(e)}, status=500)
 
 
-@require_auth
 async def api_chat_join_requests(request: web.Request) -> web.Response:
     """API: join requests for a chat (pending/declined/expired)."""
     try:
@@ -409,11 +575,6 @@ async def api_chat_join_requests(request: web.Request) -> web.Response:
             return json_response({"error": "invalid status"}, status=400)
 
         reqs = await get_join_requests(chat_id, limit=limit, offset=offset, status=status)
-        for r in reqs:
-            if r.get("request_date"):
-                r["request_date"] = r["request_date"].isoformat()
-            if r.get("created_at"):
-                r["created_at"] = r["created_at"].isoformat()
 
         return json_response({
             "chat_id": chat_id,
@@ -430,42 +591,110 @@ async def api_chat_join_requests(request: web.Request) -> web.Response:
 
 # ========== HTML Pages ==========
 
-@require_auth
-@aiohttp_jinja2.template("dashboard.html")
-async def dashboard(request: web.Request):
+async def render_template_stream(
+    template_name: str,
+    request: web.Request,
+    context: Dict[str, Any],
+) -> web.StreamResponse:
+    """Рендерит шаблон потоком (Template.generate) кусками по STREAM_CHUNK_SIZE.
+
+    Страница не собирается в памяти целиком, первые байты уходят клиенту
+    до конца рендера. Заголовки отправляются вместе с первым куском: ошибка
+    в начале шаблона ещё превращается в обычный 500.
+    """
+    template = aiohttp_jinja2.get_env(request.app).get_template(template_name)
+    response = web.StreamResponse(
+        headers={"Content-Type": "text/html; charset=utf-8", **CORS_HEADERS}
+    )
+
+    parts = []
+    size = 0
+    for chunk in template.generate(context):
+        parts.append(chunk)
+        size += len(chunk)
+        if size >= STREAM_CHUNK_SIZE:
+            if not response.prepared:
+                await response.prepare(request)
+            await response.write("".join(parts).encode("utf-8"))
+            parts = []
+            size = 0
+
+    if not response.prepared:
+        await response.prepare(request)
+    await response.write("".join(parts).encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _encode_page_cursor(msg: Dict[str, Any]) -> str:
+    """Курсор страницы: "<sent_at в микросекундах>_<message_id>" (без спецсимволов для URL)."""
+    micros = (msg["sent_at"] - _EPOCH) // timedelta(microseconds=1)
+    return f"{micros}_{msg['message_id']}"
+
+
+def _decode_page_cursor(value: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    """Разбирает курсор _encode_page_cursor; некорректный курсор игнорируется."""
+    if not value:
+        return None
+    try:
+        micros, message_id = value.split("_", 1)
+        sent_at = _EPOCH + timedelta(microseconds=int(micros))
+        message_id = int(message_id)
+    except (ValueError, OverflowError):
+        # OverflowError: отметка времени за пределами datetime
+        return None
+    # message_id — BIGINT в БД: значение вне диапазона упало бы уже в Postgres
+    if not 0 < message_id < 2 ** 63:
+        return None
+    return sent_at, message_id
+
+
+async def dashboard(request: web.Request) -> web.StreamResponse:
     """Главная страница дашборда."""
     chats = await get_dashboard_data()
 
-    return {
+    return await render_template_stream("dashboard.html", request, {
         "request": request,
         "chats": chats,
-    }
+    })
 
 
-@require_auth
-@aiohttp_jinja2.template("chats.html")
-async def chats_page(request: web.Request):
+async def chats_page(request: web.Request) -> web.StreamResponse:
     """Страница списка чатов."""
     chats = await get_chats_with_stats()
-    return {"request": request, "chats": chats}
+    return await render_template_stream("chats.html", request, {"request": request, "chats": chats})
 
 
-@require_auth
 @aiohttp_jinja2.template("messages.html")
 async def chat_messages_page(request: web.Request):
-    """Страница сообщений чата."""
+    """Страница сообщений чата.
+
+    Ссылки prev/next несут keyset-курсор (after/before) крайней строки
+    страницы; page без курсора (старые ссылки) работает через OFFSET.
+    """
     chat_id = int(request.match_info["chat_id"])
     page = int(request.query.get("page", 1))
     message_type = request.query.get("type")
     limit = 50
-    offset = (page - 1) * limit
+
+    before = _decode_page_cursor(request.query.get("before"))
+    after = _decode_page_cursor(request.query.get("after"))
     
-    chat = await get_chat_by_id(chat_id)
+    if before or after or page == 1:
+        messages_query = get_chat_messages_page(
+            chat_id, limit, message_type, before=before, after=after
+        )
+    else:
+        messages_query = get_chat_messages(chat_id, limit, (page - 1) * limit, message_type)
+
+    # Чат и страница сообщений запрашиваются параллельно
+    chat, messages = await asyncio.gather(get_chat_by_id(chat_id), messages_query)
     if not chat:
         raise web.HTTPNotFound(text="Chat not found")
     
-    messages = await get_chat_messages(chat_id, limit, offset, message_type)
-    
     config = get_config()
     is_vibecoder = False
     if chat:
@@ -481,15 +710,16 @@ async def chat_messages_page(request: web.Request):
         "messages": messages,
         "page": page,
         "message_type": message_type,
-        "has_next": len(messages) == limit,
+        # Пришли назад по after — более старые сообщения точно есть
+        "has_next": len(messages) == limit or bool(after),
         "has_prev": page > 1,
+        "prev_cursor": _encode_page_cursor(messages[0]) if messages else None,
+        "next_cursor": _encode_page_cursor(messages[-1]) if messages else None,
         "is_vibecoder": is_vibecoder,
     }
 
 
-@require_auth
-@aiohttp_jinja2.template("users.html")
-async def users_page(request: web.Request):
+async def users_page(request: web.Request) -> web.StreamResponse:
     """Страница списка пользователей."""
     page = int(request.query.get("page", 1))
     limit = 50
@@ -497,25 +727,34 @@ async def users_page(request: web.Request):
     
     users = await get_users(limit, offset)
     
-    return {
+    return await render_template_stream("users.html", request, {
         "request": request,
         "users": users,
         "page": page,
         "has_next": len(users) == limit,
         "has_prev": page > 1,
-    }
+    })
 
 
 def create_web_app() -> web.Application:
     """Создаёт и настраивает веб-приложение."""
-    app = web.Application(middlewares=[cors_middleware])
+    # cors_middleware снаружи: ответ 401 тоже получает CORS-заголовки,
+    # preflight OPTIONS отвечается до проверки авторизации
+    app = web.Application(middlewares=[cors_middleware, auth_middleware])
     
-    # Настройка Jinja2
-    aiohttp_jinja2.setup(
+    # Настройка Jinja2: шаблоны не перечитываются с диска (auto_reload=False,
+    # изменения подхватываются перезапуском), скомпилированный байткод
+    # кэшируется во временной директории и переживает рестарт процесса
+    env = aiohttp_jinja2.setup(
         app,
         loader=jinja2.FileSystemLoader(str(TEMPLATES_DIR)),
         autoescape=jinja2.select_autoescape(['html', 'xml']),
+        auto_reload=False,
+        bytecode_cache=jinja2.FileSystemBytecodeCache(),
     )
+    # Компилируем все шаблоны сразу, а не на первом запросе
+    for name in env.list_templates():
+        env.get_template(name)
     
     # Роуты
     app.router.add_get("/health", health_check)
@@ -533,6 +772,7 @@ def create_web_app() -> web.Application:
     app.router.add_get("/api/chats/{chat_id}/join-requests", api_chat_join_requests)
     app.router.add_get("/api/dashboard", api_dashboard)
     app.router.add_post("/api/chats/{chat_id}/summary", api_chat_summary)
+    app.router.add_post("/api/dashboard/summaries", api_dashboard_summaries)
     app.router.add_get("/api/chats/{chat_id}/analytics", api_chat_analytics)
     app.router.add_post("/api/chats/{chat_id}/strategy", api_chat_strategy)
 
@@ -3,43 +3,100 @@
 """
 
 import asyncio
-import json
 import logging
+import queue
 import signal
 from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+import orjson
+
+try:
+    import uvloop
+except ImportError:  # uvloop недоступен (например, Windows) — обычный asyncio loop
+    uvloop = None
 
 from app.config import get_config
 from app.database import init_pool, close_pool
 from app.models import init_database
-from app.bot.bot import create_bot, start_bot, stop_bot
-from app.bot.handlers import clean_join_requests_job
+from app.bot.bot import create_bot, start_bot, stop_bot, flush_message_buffer
+from app.bot.handlers import (
+    STATS_COMPACT_INTERVAL_SEC,
+    clean_join_requests_job,
+    compact_stats_job,
+    init_decline_audit_log,
+    stop_decline_audit_log,
+)
 from app.web.routes import create_web_app, start_web_server
+from app.services.openrouter import (
+    init_client as init_openrouter_client,
+    close_client as close_openrouter_client,
+)
 
 
 class JSONFormatter(logging.Formatter):
     """JSON formatter для структурированных логов (удобно для Railway)."""
     def format(self, record):
         log_obj = {
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
             "level": record.levelname,
             "logger": record.name,
             "message": record.getMessage()
         }
         if record.exc_info:
             log_obj["exception"] = self.formatException(record.exc_info)
-        return json.dumps(log_obj)
+        return orjson.dumps(log_obj).decode()
+
+
+class _LogQueueHandler(QueueHandler):
+    """QueueHandler, который не форматирует запись в вызывающем потоке.
+
+    Стандартный prepare() прогоняет запись через форматтер и отбрасывает
+    exc_info; здесь только фиксируется текст сообщения, а JSON и трейсбек
+    собирает JSONFormatter в потоке QueueListener.
+    """
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+# Поток, который форматирует логи и пишет их в stderr
+_log_listener: Optional[QueueListener] = None
 
 
 def setup_logging(level: str = "INFO"):
-    """Настраивает логирование."""
+    """Настраивает логирование.
+
+    Event loop только кладёт запись в очередь; сериализация в JSON и запись
+    в stderr идут в потоке QueueListener.
+    """
+    global _log_listener
+
     handler = logging.StreamHandler()
     handler.setFormatter(JSONFormatter())
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    _log_listener = QueueListener(records, handler, respect_handler_level=True)
+    _log_listener.start()
+
     logging.basicConfig(
         level=getattr(logging, level.upper(), logging.INFO),
-        handlers=[handler]
+        handlers=[_LogQueueHandler(records)]
     )
 
 
+def stop_logging():
+    """Дописывает очередь логов и останавливает поток записи."""
+    global _log_listener
+    if _log_listener is None:
+        return
+
+    _log_listener.stop()
+    _log_listener = None
+
+
 async def main():
     """Главная функция запуска приложения."""
     # Загружаем конфигурацию
@@ -66,19 +123,30 @@ async def main():
 
     try:
         # Инициализируем базу данных
-        await init_pool(config.database_url)
+        await init_pool(config.database_url, config.db_pool_min_size, config.db_pool_max_size)
         await init_database()
         logger.info("Database initialized")
 
+        if config.has_openrouter:
+            await init_openrouter_client()
+
         # Создаём и запускаем веб-сервер
         web_app = create_web_app()
         web_runner = await start_web_server(web_app, config.port)
         logger.info(f"Admin panel available at http://localhost:{config.port}")
 
         # Создаём и запускаем бота
-        bot_app = create_bot(config.telegram_token)
+        bot_app = create_bot(config)
+
+        bot_app.job_queue.run_repeating(
+            compact_stats_job,
+            interval=STATS_COMPACT_INTERVAL_SEC,
+            first=STATS_COMPACT_INTERVAL_SEC,
+            name="compact_stats",
+        )
 
         if config.vibecoder_chat_id:
+            init_decline_audit_log(config.declined_requests_log_path)
             bot_app.job_queue.run_repeating(
                 clean_join_requests_job,
                 interval=config.join_request_clean_interval_sec,
@@ -109,16 +177,25 @@ async def main():
                 await asyncio.wait_for(stop_bot(bot_app), timeout=5.0)
             except asyncio.TimeoutError:
                 logger.warning("Bot stop timed out, forcing shutdown")
+            # Остаток буфера пишется уже вне 5-секундного таймаута остановки бота
+            await flush_message_buffer(bot_app)
 
         if web_runner:
             await web_runner.cleanup()
 
+        await close_openrouter_client()
+
         await close_pool()
+        stop_decline_audit_log()
         logger.info("Shutdown complete")
+        stop_logging()
 
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if uvloop is not None:
+            uvloop.run(main())
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         pass
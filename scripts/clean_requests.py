@@ -27,7 +27,11 @@ from telegram import Bot
 from app.config import get_config
 from app.database import init_pool, close_pool
 from app.models import init_database, get_pending_fresh_join_requests
-from app.bot.handlers import process_pending_fresh_join_requests
+from app.bot.handlers import (
+    init_decline_audit_log,
+    process_pending_fresh_join_requests,
+    stop_decline_audit_log,
+)
 
 
 async def main() -> None:
@@ -36,7 +40,7 @@ async def main() -> None:
         print("Error: VIBECODER_CHAT_ID is required")
         return
 
-    await init_pool(cfg.database_url)
+    await init_pool(cfg.database_url, cfg.db_pool_min_size, cfg.db_pool_max_size)
     await init_database()
 
     pending = await get_pending_fresh_join_requests(
@@ -49,16 +53,17 @@ async def main() -> None:
         await close_pool()
         return
 
+    init_decline_audit_log(cfg.declined_requests_log_path)
     async with Bot(cfg.telegram_token) as bot:
-        declined, processed = await process_pending_fresh_join_requests(
+        declined, processed, _ = await process_pending_fresh_join_requests(
             bot,
             cfg.vibecoder_chat_id,
             cfg.fresh_account_id_threshold,
             cfg.join_request_clean_batch_limit,
-            cfg.declined_requests_log_path,
         )
 
     await close_pool()
+    stop_decline_audit_log()
     print(f"Declined {declined}/{processed} pending requests")
 
 